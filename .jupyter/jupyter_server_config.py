@@ -1,8 +1,14 @@
 import asyncio
+import collections
+import heapq
+import itertools
+import json
+import math
 import os
+import time
 
 from jupyter_server.services.kernels.kernelmanager import AsyncMappingKernelManager
-from traitlets import Integer, observe
+from traitlets import Float, Integer, Unicode
 
 
 class LimitingKernelManager(AsyncMappingKernelManager):
@@ -10,8 +16,16 @@ class LimitingKernelManager(AsyncMappingKernelManager):
     Kernel manager that caps how many kernels exist at once.
 
     - max_kernels: maximum number of live kernels.
-    - Each started kernel acquires a slot.
+    - Each started kernel takes a slot.
     - Each shutdown (or shutdown_all) releases slots.
+    - pool_size: number of idle kernels kept ready with `pool_warmup_code`
+      already executed. Requests for the default kernel get one of these;
+      the pool is refilled in the background using free slots only.
+    - Waiting requests are served longest notebook first, using the kernel
+      lifetimes of previous builds stored in `timing_history`, so that a
+      slow notebook does not start last and set the build time alone.
+    - Kernels inherit ``COURSE_WORKERS``, the share of the CPUs that each of
+      them may use for parallel sweeps, unless it is already set.
     """
 
     max_kernels = Integer(
@@ -20,25 +34,220 @@ class LimitingKernelManager(AsyncMappingKernelManager):
         help="Maximum number of kernels that may run concurrently.",
     )
 
+    pool_size = Integer(
+        0,
+        config=True,
+        help="Number of pre-started kernels to keep; they count towards max_kernels.",
+    )
+
+    pool_warmup_code = Unicode(
+        "import numpy, kwant, plotly.graph_objects, course.init_course, course.functions",
+        config=True,
+        help="Code executed in pooled kernels before they are handed out.",
+    )
+
+    timing_history = Unicode(
+        "_build/execution_times.json",
+        config=True,
+        help="File with the kernel lifetime of every notebook, relative to root_dir.",
+    )
+
+    schedule_delay = Float(
+        0.5,
+        config=True,
+        help="Seconds to collect simultaneous requests before ordering them.",
+    )
+
     def __init__(self, **kwargs):
         super().__init__(**kwargs)
-        # semaphore with 'max_kernels' slots, each slot == one live kernel
-        self._kernel_slots = asyncio.Semaphore(self.max_kernels)
+        # one slot == one live kernel, pooled or not
+        self._used_slots = 0
+        # heap of (-expected duration, arrival, future, poolable)
+        self._waiters = []
+        self._arrivals = itertools.count()
+        self._dispatch_handle = None
+        # warmed-up kernels, and the tasks still starting new ones
+        self._warm_kernels = collections.deque()
+        self._warming = set()
+        self._closing = False
+        # kernel_id -> (notebook, start time) of kernels in use
+        self._started = {}
+        self._durations = self._load_history()
+        # max_kernels notebooks run at once, so split the CPUs between them.
+        try:
+            cpus = len(os.sched_getaffinity(0))
+        except AttributeError:
+            cpus = os.cpu_count() or 1
+        os.environ.setdefault("COURSE_WORKERS", str(max(1, cpus // self.max_kernels)))
+
+    def _history_path(self):
+        return os.path.join(self.root_dir, self.timing_history)
+
+    def _load_history(self):
+        try:
+            with open(self._history_path(), encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def _record_duration(self, kernel_id):
+        notebook, start = self._started.pop(kernel_id, (None, None))
+        if notebook is None:
+            return
+        self._durations[notebook] = round(time.monotonic() - start, 2)
+        path = self._history_path()
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path + ".tmp", "w", encoding="utf-8") as f:
+                json.dump(self._durations, f, indent=2, sort_keys=True)
+            os.replace(path + ".tmp", path)
+        except OSError:
+            self.log.warning("Could not write execution times to %s", path)
 
-    @observe("max_kernels")
-    def _on_max_kernels_changed(self, change):
-        # if config changes, reset semaphore; simplest is to recreate it
-        self._kernel_slots = asyncio.Semaphore(change["new"])
+    def _notebook(self, kwargs):
+        """Name under which the execution time of a request is recorded."""
+        env = kwargs.get("env") or {}
+        notebook = env.get("JPY_SESSION_NAME") or kwargs.get("path")
+        if notebook and os.path.isabs(notebook):
+            notebook = os.path.relpath(notebook, self.root_dir)
+        return notebook
+
+    async def _wait_for_turn(self, notebook, poolable):
+        """Wait until this request may have a pooled kernel or a free slot.
+
+        Returns the id of a pooled kernel, or None if a slot was reserved.
+        Unknown notebooks go first, the rest by decreasing expected duration.
+        """
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        expected = self._durations.get(notebook, math.inf)
+        heapq.heappush(
+            self._waiters, (-expected, next(self._arrivals), future, poolable)
+        )
+        if self._dispatch_handle is None:
+            self._dispatch_handle = loop.call_later(self.schedule_delay, self._dispatch)
+        return await future
+
+    def _dispatch(self, refill=True):
+        """Hand out pooled kernels and free slots to the waiting requests."""
+        if self._dispatch_handle is not None:
+            self._dispatch_handle.cancel()
+            self._dispatch_handle = None
+        while self._waiters:
+            *_, future, poolable = self._waiters[0]
+            if future.done():  # the request was cancelled
+                heapq.heappop(self._waiters)
+                continue
+            while self._warm_kernels and self._warm_kernels[0] not in self:
+                self._warm_kernels.popleft()  # shut down while pooled
+            if poolable and self._warm_kernels:
+                result = self._warm_kernels.popleft()
+            elif self._used_slots < self.max_kernels:
+                self._used_slots += 1
+                result = None
+            elif self._warm_kernels:
+                # Idle pooled kernels must not block other kernels from
+                # starting, so take over the slot of one.
+                asyncio.create_task(self._shutdown_pooled(self._warm_kernels.popleft()))
+                result = None
+            else:
+                break
+            heapq.heappop(self._waiters)
+            future.set_result(result)
+        if refill:
+            self._refill_pool()
+
+    def _refill_pool(self):
+        # Never take a slot that a waiting request could use.
+        while (
+            not self._closing
+            and len(self._warm_kernels) + len(self._warming) < self.pool_size
+            and self._used_slots < self.max_kernels
+            and not any(not waiter[2].done() for waiter in self._waiters)
+        ):
+            self._used_slots += 1
+            task = asyncio.create_task(self._start_warm_kernel())
+            self._warming.add(task)
+            task.add_done_callback(self._warming.discard)
+
+    def _release_slot(self, refill=True):
+        self._used_slots -= 1
+        self._dispatch(refill)
+
+    async def _run_in_kernel(self, kernel_id, code):
+        client = self.get_kernel(kernel_id).client()
+        client.start_channels()
+        try:
+            await client.wait_for_ready(timeout=60)
+            reply = await client.execute(
+                code, silent=True, store_history=False, reply=True, timeout=300
+            )
+        finally:
+            client.stop_channels()
+        if reply["content"]["status"] != "ok":
+            raise RuntimeError(f"Kernel setup failed: {reply['content'].get('evalue')}")
+
+    async def _start_warm_kernel(self):
+        # The slot is already taken by `_refill_pool`.
+        try:
+            kernel_id = await super().start_kernel(kernel_name=self.default_kernel_name)
+        except Exception:
+            self.log.exception("Could not start a pooled kernel")
+            # Do not retry right away.
+            self._release_slot(refill=False)
+            return
+        try:
+            await self._run_in_kernel(kernel_id, self.pool_warmup_code)
+        except Exception:
+            self.log.exception("Could not warm up pooled kernel %s", kernel_id)
+            await super().shutdown_kernel(kernel_id)
+            self._release_slot(refill=False)
+            return
+        self._warm_kernels.append(kernel_id)
+        self._dispatch()
+
+    async def _shutdown_pooled(self, kernel_id):
+        # Keeps the slot, which the caller hands to another request.
+        await super().shutdown_kernel(kernel_id)
 
     async def start_kernel(self, *args, **kwargs):
-        # Wait for a free slot; this is atomic across concurrent requests.
-        await self._kernel_slots.acquire()
+        if kwargs.get("kernel_id") in self:
+            # Jupyter server returns the existing kernel, no new slot needed.
+            return await super().start_kernel(*args, **kwargs)
+        poolable = (
+            self.pool_size > 0
+            and not args
+            and kwargs.get("kernel_id") is None
+            and kwargs.get("kernel_name") in (None, self.default_kernel_name)
+        )
+        notebook = self._notebook(kwargs)
+        kernel_id = await self._wait_for_turn(notebook, poolable)
+        if kernel_id is not None:
+            kernel_id = await self._adopt_kernel(kernel_id, **kwargs)
+        else:
+            try:
+                kernel_id = await super().start_kernel(*args, **kwargs)
+            except Exception:
+                # If startup failed, free the slot again.
+                self._release_slot()
+                raise
+        self._started[kernel_id] = (notebook, time.monotonic())
+        return kernel_id
+
+    async def _adopt_kernel(self, kernel_id, path=None, env=None, **kwargs):
+        """Give a pooled kernel the working directory and environment of a request."""
+        setup = ["import os"]
+        if path is not None:
+            setup.append(f"os.chdir({self.cwd_for_path(path)!r})")
+        changed = {k: v for k, v in (env or {}).items() if os.environ.get(k) != v}
+        if changed:
+            setup.append(f"os.environ.update({changed!r})")
         try:
-            kernel_id = await super().start_kernel(*args, **kwargs)
+            await self._run_in_kernel(kernel_id, "\n".join(setup))
         except Exception:
-            # If startup failed, free the slot again.
-            self._kernel_slots.release()
+            await self.shutdown_kernel(kernel_id)
             raise
+        self.log.info("Using pooled kernel: %s", kernel_id)
         return kernel_id
 
     async def shutdown_kernel(self, kernel_id, *args, **kwargs):
@@ -46,14 +255,21 @@ class LimitingKernelManager(AsyncMappingKernelManager):
             return await super().shutdown_kernel(kernel_id, *args, **kwargs)
         finally:
             # Kernel is gone -> free a slot.
-            self._kernel_slots.release()
+            self._record_duration(kernel_id)
+            self._release_slot()
 
     async def shutdown_all(self, *args, **kwargs):
+        # Let pooled kernels finish starting, without starting new ones.
+        self._closing = True
+        await asyncio.gather(*self._warming, return_exceptions=True)
+        self._warm_kernels.clear()
+        self._started.clear()
         try:
             return await super().shutdown_all(*args, **kwargs)
         finally:
-            # All kernels gone -> reset semaphore to full capacity.
-            self._kernel_slots = asyncio.Semaphore(self.max_kernels)
+            # All kernels gone -> all slots are free again.
+            self._used_slots = 0
+            self._closing = False
 
 
 c = get_config()  # noqa: F821
@@ -74,3 +290,11 @@ if env_val:
         c.LimitingKernelManager.max_kernels = 4
 else:
     c.LimitingKernelManager.max_kernels = 4
+
+# Keep warm kernels ready, by default one per slot. Set JUPYTER_KERNEL_POOL_SIZE
+# to 0 to start every kernel on demand instead.
+pool_val = os.getenv("JUPYTER_KERNEL_POOL_SIZE")
+try:
+    c.LimitingKernelManager.pool_size = max(0, int(pool_val))
+except (TypeError, ValueError):
+    c.LimitingKernelManager.pool_size = c.LimitingKernelManager.max_kernels
@@ -1,10 +1,12 @@
-"""Utilities shared across the TopoCM course."""
+"""Utilities shared across the TopoCM course.
 
-from importlib import metadata as _metadata
-
-from . import functions as functions
-from . import init_course as init_course
+The submodules are imported on first access (PEP 562), so that importing a
+single one of them, for example ``course.datasets``, does not also pay for
+Kwant, Plotly and IPython.
+"""
 
+import importlib as _importlib
+from importlib import metadata as _metadata
 
 try:  # pragma: no cover - metadata only available once installed
     __version__ = _metadata.version("topocm-course")
@@ -12,8 +14,57 @@ except _metadata.PackageNotFoundError:  # pragma: no cover
     __version__ = "0.0.0"
 
 
+_submodules = {
+    "caching",
+    "datasets",
+    "disorder",
+    "functions",
+    "init_course",
+    "topomech",
+    "transport",
+}
+_attributes = {"cache": "caching"}
+
+# ``course.functions.__all__``, kept here so that `course.init_course` can list
+# and re-export these names without importing Kwant.
+_functions_all = (
+    "spectrum",
+    "hamiltonian_array",
+    "h_k",
+    "pauli",
+    "line_plot",
+    "area_plot",
+    "slider_plot",
+    "combine_plots",
+    "add_reference_lines",
+    "set_default_plotly_template",
+    "clear_system_cache",
+    "sweep",
+    "eigvalsh",
+)
+
 __all__ = [
+    "cache",
+    "caching",
+    "datasets",
+    "disorder",
     "functions",
     "init_course",
+    "topomech",
+    "transport",
     "__version__",
 ]
+
+
+def __getattr__(name):
+    if name in _submodules:
+        return _importlib.import_module(f".{name}", __name__)
+    if name in _attributes:
+        return getattr(
+            _importlib.import_module(f".{_attributes[name]}", __name__), name
+        )
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+def __dir__():
+    return sorted({*globals(), *_submodules, *_attributes})
@@ -0,0 +1,176 @@
+"""Persistent on-disk memoization of expensive notebook computations.
+
+Results are stored in a content-addressed directory, keyed on the source of the
+decorated function, its arguments, and the versions of NumPy and Kwant. Arrays
+are saved as ``.npy`` files, other results are pickled. The least recently used
+entries are evicted once the total size of the store exceeds a limit.
+"""
+
+import functools
+import hashlib
+import importlib.metadata
+import inspect
+import os
+import pickle
+import tempfile
+from pathlib import Path
+
+import numpy as np
+
+__all__ = ["cache", "clear_cache"]
+
+CACHE_DIR = Path(
+    os.getenv(
+        "COURSE_CACHE_DIR",
+        Path(__file__).resolve().parents[1] / "_build" / "cache",
+    )
+)
+MAX_SIZE = 2**30
+
+
+def _update_hash(digest, obj):
+    """Feed a canonical representation of ``obj`` into ``digest``."""
+    if obj is None or isinstance(obj, (bool, int, float, complex, str, bytes)):
+        digest.update(f"{type(obj).__name__}:{obj!r};".encode())
+    elif isinstance(obj, (np.ndarray, np.generic)):
+        obj = np.ascontiguousarray(obj)
+        if obj.dtype.hasobject:
+            raise TypeError("Cannot cache calls with object arrays as arguments.")
+        digest.update(f"ndarray:{obj.dtype.str}:{obj.shape};".encode())
+        digest.update(obj.tobytes())
+    elif isinstance(obj, (tuple, list)):
+        digest.update(f"{type(obj).__name__}:{len(obj)};".encode())
+        for item in obj:
+            _update_hash(digest, item)
+    elif isinstance(obj, dict):
+        digest.update(f"dict:{len(obj)};".encode())
+        for key in sorted(obj, key=repr):
+            _update_hash(digest, key)
+            _update_hash(digest, obj[key])
+    else:
+        raise TypeError(
+            f"Cannot cache calls with arguments of type {type(obj).__name__}."
+        )
+
+
+def _source(func):
+    try:
+        return inspect.getsource(func)
+    except (OSError, TypeError):
+        return func.__code__.co_code.hex()
+
+
+@functools.cache
+def _kwant_version():
+    # Read from the metadata, importing Kwant is slow.
+    return importlib.metadata.version("kwant")
+
+
+def _key(func, depends, arguments):
+    digest = hashlib.sha256()
+    _update_hash(
+        digest,
+        (
+            func.__qualname__,
+            [_source(f) for f in (func, *depends)],
+            np.__version__,
+            _kwant_version(),
+        ),
+    )
+    _update_hash(digest, arguments)
+    return f"{func.__name__}-{digest.hexdigest()}"
+
+
+def _evict(directory, max_size):
+    """Remove least recently used entries until the store fits in ``max_size``."""
+    entries = [
+        (path.stat(), path)
+        for path in directory.iterdir()
+        if path.suffix in (".npy", ".pkl")
+    ]
+    total = sum(stat.st_size for stat, _ in entries)
+    for stat, path in sorted(entries, key=lambda entry: entry[0].st_mtime):
+        if total <= max_size:
+            break
+        path.unlink(missing_ok=True)
+        total -= stat.st_size
+
+
+def _load(path):
+    if path.suffix == ".npy":
+        return np.load(path, allow_pickle=False)
+    with open(path, "rb") as f:
+        return pickle.load(f)
+
+
+def _store(path, result):
+    # A temporary file of its own, as other processes may store the same key.
+    with tempfile.NamedTemporaryFile(
+        dir=path.parent, prefix=f".{path.name}.", suffix=".tmp", delete=False
+    ) as f:
+        try:
+            if path.suffix == ".npy":
+                np.save(f, result, allow_pickle=False)
+            else:
+                pickle.dump(result, f, protocol=pickle.HIGHEST_PROTOCOL)
+        except BaseException:
+            f.close()
+            os.unlink(f.name)
+            raise
+    os.replace(f.name, path)
+
+
+def cache(func=None, *, depends=(), directory=None, max_size=None):
+    """Memoize a function on disk.
+
+    Can be used both as ``@cache`` and as ``@cache(depends=(helper,))``.
+
+    Parameters
+    ----------
+    func : callable
+        Function to memoize. Its arguments must be built from numbers, strings,
+        NumPy arrays, and lists, tuples or dicts of those.
+    depends : sequence of callables
+        Other functions whose source should invalidate the cache when changed,
+        for example helpers that ``func`` calls.
+    directory : str or Path, optional
+        Location of the store, defaults to ``CACHE_DIR``, which may be set with
+        the ``COURSE_CACHE_DIR`` environment variable.
+    max_size : int, optional
+        Maximum total size of the store in bytes, defaults to ``MAX_SIZE``.
+    """
+    if func is None:
+        return functools.partial(
+            cache, depends=depends, directory=directory, max_size=max_size
+        )
+
+    signature = inspect.signature(func)
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        store = Path(directory) if directory is not None else CACHE_DIR
+        bound = signature.bind(*args, **kwargs)
+        bound.apply_defaults()
+        key = _key(func, depends, dict(bound.arguments))
+        for suffix in (".npy", ".pkl"):
+            path = store / (key + suffix)
+            if path.exists():
+                os.utime(path)
+                return _load(path)
+
+        result = func(*args, **kwargs)
+        array = isinstance(result, np.ndarray) and not result.dtype.hasobject
+        path = store / (key + (".npy" if array else ".pkl"))
+        store.mkdir(parents=True, exist_ok=True)
+        _store(path, result)
+        _evict(store, MAX_SIZE if max_size is None else max_size)
+        return result
+
+    return wrapper
+
+
+def clear_cache(directory=None):
+    """Remove all entries from the store."""
+    store = Path(directory) if directory is not None else CACHE_DIR
+    if store.exists():
+        _evict(store, 0)
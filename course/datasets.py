@@ -0,0 +1,91 @@
+"""Storage of precomputed numerical results shipped with the course.
+
+A dataset is a directory holding one ``.npy`` file per array and a
+``metadata.json`` file describing how the arrays were computed (parameters,
+number of disorder realizations, random salts, ...). Arrays are opened
+memory-mapped, so reading large sweeps does not require parsing or copying
+them. `export_text` writes a human-readable copy for reviewing changes.
+"""
+
+import json
+import os
+from pathlib import Path
+
+import numpy as np
+
+__all__ = ["save", "load", "exists", "export_text"]
+
+METADATA_FILE = "metadata.json"
+
+
+def exists(path):
+    """Check whether ``path`` contains a dataset."""
+    return (Path(path) / METADATA_FILE).is_file()
+
+
+def save(path, metadata=None, **arrays):
+    """Store arrays together with their metadata.
+
+    Parameters
+    ----------
+    path : str or Path
+        Dataset directory, created if it does not exist.
+    metadata : dict, optional
+        JSON-serializable description of the data.
+    **arrays : array_like
+        Arrays to store, saved as ``<name>.npy``.
+    """
+    path = Path(path)
+    path.mkdir(parents=True, exist_ok=True)
+    for name, array in arrays.items():
+        tmp = path / f"{name}.npy.tmp"
+        with open(tmp, "wb") as f:
+            np.save(f, np.asarray(array), allow_pickle=False)
+        os.replace(tmp, path / f"{name}.npy")
+    metadata = {**(metadata or {}), "arrays": sorted(arrays)}
+    (path / METADATA_FILE).write_text(
+        json.dumps(metadata, indent=2, sort_keys=True) + "\n", encoding="utf-8"
+    )
+
+
+def load(path, mmap_mode="r"):
+    """Load a dataset.
+
+    Parameters
+    ----------
+    path : str or Path
+        Dataset directory.
+    mmap_mode : {"r", "r+", "c", None}
+        Passed to `numpy.load`; use ``None`` to read the arrays into memory.
+
+    Returns
+    -------
+    arrays : dict
+        Mapping from array names to (memory-mapped) arrays.
+    metadata : dict
+    """
+    path = Path(path)
+    metadata = json.loads((path / METADATA_FILE).read_text(encoding="utf-8"))
+    arrays = {
+        name: np.load(path / f"{name}.npy", mmap_mode=mmap_mode, allow_pickle=False)
+        for name in metadata.pop("arrays")
+    }
+    return arrays, metadata
+
+
+def export_text(path, destination=None, fmt="%.10g"):
+    """Write every array of a dataset as a text file for inspection.
+
+    The metadata is included as a comment header. Arrays with more than two
+    dimensions are flattened to two.
+    """
+    path = Path(path)
+    destination = Path(destination) if destination is not None else path
+    destination.mkdir(parents=True, exist_ok=True)
+    arrays, metadata = load(path)
+    header = json.dumps(metadata, sort_keys=True)
+    for name, array in arrays.items():
+        array = np.asarray(array)
+        if array.ndim > 2:
+            array = array.reshape(array.shape[0], -1)
+        np.savetxt(destination / f"{name}.dat", array, fmt=fmt, header=header)
@@ -0,0 +1,146 @@
+"""Averaging of observables over disorder realizations."""
+
+from types import SimpleNamespace
+
+import numpy as np
+
+from .functions import _call_sweep_function, _default_workers, _forked_pool
+
+__all__ = ["RunningStatistics", "ensemble_average"]
+
+
+class RunningStatistics:
+    """Streaming mean and variance of a sequence of arrays.
+
+    Uses Welford's update for single samples and Chan's formula for merging
+    partial results, so that realizations never need to be stored.
+    """
+
+    def __init__(self):
+        self.count = 0
+        self.mean = 0.0
+        self._m2 = 0.0
+
+    def add(self, value):
+        value = np.asarray(value, dtype=float)
+        self.count += 1
+        delta = value - self.mean
+        self.mean = self.mean + delta / self.count
+        self._m2 = self._m2 + delta * (value - self.mean)
+
+    def merge(self, other):
+        if not other.count:
+            return
+        count = self.count + other.count
+        delta = other.mean - self.mean
+        self.mean = self.mean + delta * other.count / count
+        self._m2 = self._m2 + other._m2 + delta**2 * self.count * other.count / count
+        self.count = count
+
+    @property
+    def variance(self):
+        """Unbiased sample variance."""
+        if self.count < 2:
+            return np.full_like(np.asarray(self.mean, dtype=float), np.nan)
+        return self._m2 / (self.count - 1)
+
+    @property
+    def error(self):
+        """Standard error of the mean."""
+        return np.sqrt(self.variance / max(self.count, 1))
+
+
+def ensemble_average(
+    syst,
+    params,
+    observable,
+    n,
+    *,
+    tolerance=None,
+    workers=None,
+    chunk_size=10,
+    salt="salt",
+    batched=False,
+):
+    """Average an observable over disorder realizations.
+
+    Realization ``i`` is computed with ``params[salt] = str(i)``. The salts are
+    split into consecutive chunks of ``chunk_size`` that are evaluated by
+    forked worker processes and merged in order, so the result does not
+    depend on the number of workers.
+
+    Parameters
+    ----------
+    syst : kwant.system.FiniteSystem
+        System passed to ``observable``, sent to every worker only once.
+    params : dict
+        Parameters of the system, without the salt.
+    observable : callable
+        ``observable(syst, params)`` returning a number or an array. If
+        ``batched``, called instead with a list of parameter sets and
+        returning an array with one result per parameter set.
+    n : int
+        Maximal number of realizations.
+    tolerance : float, optional
+        Stop after the first chunk at which the standard error of every
+        component of the mean is below ``tolerance``.
+    workers : int, optional
+        Number of worker processes, defaults to ``COURSE_WORKERS`` or else the
+        number of available CPUs.
+    chunk_size : int
+        Number of realizations per unit of work.
+    salt : str
+        Name of the parameter that selects the disorder realization.
+    batched : bool
+        Whether ``observable`` evaluates a whole chunk of realizations at
+        once, for example using `course.transport.smatrix_1d`.
+
+    Returns
+    -------
+    result : SimpleNamespace
+        With attributes ``mean``, ``variance``, ``error`` (standard error of
+        the mean) and ``count`` (number of realizations used).
+    """
+    chunks = [range(i, min(i + chunk_size, n)) for i in range(0, n, chunk_size)]
+
+    def evaluate(salts):
+        stats = RunningStatistics()
+        if batched:
+            values = observable(syst, [{**params, salt: str(i)} for i in salts])
+        else:
+            values = (observable(syst, {**params, salt: str(i)}) for i in salts)
+        for value in values:
+            stats.add(value)
+        return stats
+
+    def converged(stats):
+        return (
+            tolerance is not None
+            and stats.count > 1
+            and np.all(stats.error <= tolerance)
+        )
+
+    if workers is None:
+        workers = _default_workers()
+    total = RunningStatistics()
+    with _forked_pool(evaluate, min(workers, len(chunks))) as executor:
+        if executor is None:
+            for chunk in chunks:
+                total.merge(evaluate(chunk))
+                if converged(total):
+                    break
+        else:
+            futures = [executor.submit(_call_sweep_function, c) for c in chunks]
+            for future in futures:
+                total.merge(future.result())
+                if converged(total):
+                    break
+            for future in futures:
+                future.cancel()
+
+    return SimpleNamespace(
+        mean=total.mean,
+        variance=total.variance,
+        error=total.error,
+        count=total.count,
+    )
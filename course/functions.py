@@ -1,6 +1,13 @@
 import collections
+import concurrent.futures
+import contextlib
+import inspect
 import itertools
 import math
+import multiprocessing
+import os
+import warnings
+import weakref
 from copy import copy
 from types import SimpleNamespace
 
@@ -8,27 +15,36 @@ import kwant
 import numpy as np
 import plotly.graph_objects as go
 import plotly.io as pio
-from plotly.subplots import make_subplots
+from scipy import linalg as la
+from scipy import sparse
+from scipy.sparse import linalg as sla
+
+from . import _functions_all
 
 if tuple(int(i) for i in np.__version__.split(".")[:3]) <= (1, 8, 0):
     raise RuntimeError("numpy >= (1, 8, 0) is required")
 
-__all__ = [
-    "spectrum",
-    "hamiltonian_array",
-    "h_k",
-    "pauli",
-    "line_plot",
-    "area_plot",
-    "slider_plot",
-    "combine_plots",
-    "add_reference_lines",
-    "set_default_plotly_template",
-]
-
-
-def set_default_plotly_template():
-    """Register a simple default Plotly template for the course."""
+__all__ = list(_functions_all)
+
+
+_float_dtype = np.float32
+
+
+def set_default_plotly_template(float_dtype=None):
+    """Register a simple default Plotly template for the course.
+
+    Parameters
+    ----------
+    float_dtype : numpy dtype, optional
+        Precision of the float arrays stored in the figures made by this
+        module, which Plotly serializes as base64 typed arrays. Defaults to
+        ``float32``, which is plenty for plotting and halves the size of the
+        data; use ``float64`` to keep full precision. The setting persists
+        for all subsequent figures.
+    """
+    global _float_dtype
+    if float_dtype is not None:
+        _float_dtype = np.dtype(float_dtype).type
     template_name = "topocm"
     if template_name not in pio.templates:
         pio.templates[template_name] = go.layout.Template(
@@ -43,6 +59,22 @@ def set_default_plotly_template():
     pio.templates.default = template_name
 
 
+def _plot_array(values):
+    """Convert float data to the precision set in `set_default_plotly_template`.
+
+    Other data, such as lists containing ``None`` separators, is returned as is.
+    """
+    if values is None:
+        return values
+    try:
+        array = np.asarray(values)
+    except ValueError:
+        return values
+    if array.dtype.kind != "f":
+        return values
+    return array.astype(_float_dtype, copy=False)
+
+
 def _validate_plain_text(text, *, where="text"):
     """Ensure text contains no LaTeX, for contexts that disallow math rendering."""
     if not isinstance(text, str):
@@ -144,6 +176,7 @@ def line_plot(
     """Plot one or many lines sharing the same x-axis."""
     title = _validate_plot_text(title, where="title")
     fig = go.Figure()
+    x = _plot_array(x)
     ys = np.array(ys)
     if ys.ndim == 1:
         ys = ys[:, None]
@@ -158,7 +191,7 @@ def line_plot(
         trace_color = colors[idx % len(colors)] if colors else color
         fig.add_scatter(
             x=x,
-            y=ys[:, idx],
+            y=_plot_array(ys[:, idx]),
             mode="lines",
             name=labels[idx],
             line=dict(color=trace_color),
@@ -197,8 +230,8 @@ def area_plot(
     fig = go.Figure()
     line_color = line_color or "#1f77b4"
     fig.add_scatter(
-        x=x,
-        y=y,
+        x=_plot_array(x),
+        y=_plot_array(y),
         mode="lines",
         line=dict(color=line_color, width=2),
         fill="tozeroy",
@@ -221,6 +254,9 @@ def area_plot(
 
 def combine_plots(figures, *, cols=2, shared_x=False, shared_y=False, titles=None):
     """Arrange multiple plotly figures into a grid."""
+    # Imported here because it takes longer than the rest of plotly together.
+    from plotly.subplots import make_subplots
+
     set_default_plotly_template()
     cols = max(1, int(cols))
     rows = math.ceil(len(figures) / cols)
@@ -237,38 +273,41 @@ def combine_plots(figures, *, cols=2, shared_x=False, shared_y=False, titles=Non
         subplot_titles=subplot_titles,
         vertical_spacing=0.25,
     )
+
+    # Assemble the plain dicts of all subplots and build the figure at once.
+    layout = fig.layout.to_plotly_json()
+    data = []
+    shapes = list(layout.get("shapes", ()))
     for idx, src in enumerate(figures):
-        r, c = divmod(idx, cols)
-        r += 1
-        c += 1
+        axis_idx = idx + 1
+        suffix = "" if axis_idx == 1 else str(axis_idx)
         for trace in src.data:
-            fig.add_trace(trace, row=r, col=c)
+            trace_dict = trace.to_plotly_json()
+            trace_dict["xaxis"], trace_dict["yaxis"] = f"x{suffix}", f"y{suffix}"
+            data.append(trace_dict)
         # Copy shapes (like reference lines) to the subplot
-        if src.layout.shapes:
-            axis_idx = idx + 1
-            xref = "x" if axis_idx == 1 else f"x{axis_idx}"
-            yref = "y" if axis_idx == 1 else f"y{axis_idx}"
-            xdomain = "x domain" if axis_idx == 1 else f"x{axis_idx} domain"
-            ydomain = "y domain" if axis_idx == 1 else f"y{axis_idx} domain"
-            for shape in src.layout.shapes:
-                # Create a copy of the shape and adjust it for the subplot
-                shape_dict = shape.to_plotly_json()
-                # Update xref and yref to target the correct subplot
-                if "xref" in shape_dict:
-                    if shape_dict["xref"] in ("x", "x1"):
-                        shape_dict["xref"] = xref
-                    elif shape_dict["xref"] in ("paper", "x domain"):
-                        shape_dict["xref"] = xdomain
-                if "yref" in shape_dict:
-                    if shape_dict["yref"] in ("y", "y1"):
-                        shape_dict["yref"] = yref
-                    elif shape_dict["yref"] in ("paper", "y domain"):
-                        shape_dict["yref"] = ydomain
-                fig.add_shape(**shape_dict)
-        if src.layout.xaxis:
-            fig.update_xaxes(**_copy_axis_settings(src.layout.xaxis), row=r, col=c)
-        if src.layout.yaxis:
-            fig.update_yaxes(**_copy_axis_settings(src.layout.yaxis), row=r, col=c)
+        for shape in src.layout.shapes or ():
+            shape_dict = shape.to_plotly_json()
+            # Update xref and yref to target the correct subplot
+            if "xref" in shape_dict:
+                if shape_dict["xref"] in ("x", "x1"):
+                    shape_dict["xref"] = f"x{suffix}"
+                elif shape_dict["xref"] in ("paper", "x domain"):
+                    shape_dict["xref"] = f"x{suffix} domain"
+            if "yref" in shape_dict:
+                if shape_dict["yref"] in ("y", "y1"):
+                    shape_dict["yref"] = f"y{suffix}"
+                elif shape_dict["yref"] in ("paper", "y domain"):
+                    shape_dict["yref"] = f"y{suffix} domain"
+            shapes.append(shape_dict)
+    if shapes:
+        layout["shapes"] = shapes
+    fig = go.Figure(data=data, layout=layout)
+    for idx, src in enumerate(figures):
+        suffix = "" if idx == 0 else str(idx + 1)
+        for name, axis in (("xaxis", src.layout.xaxis), ("yaxis", src.layout.yaxis)):
+            if axis:
+                fig.layout[name + suffix].update(_copy_axis_settings(axis))
     template_margin = pio.templates[
         pio.templates.default
     ].layout.margin.to_plotly_json()
@@ -294,8 +333,113 @@ def _validate_plot_text(text, *, where="text"):
     return text
 
 
-def slider_plot(figures, *, label="value", initial=None, play=False):
-    """Create a slider that switches between a set of pre-built figures."""
+def _plotly_json(value):
+    if hasattr(value, "to_plotly_json"):
+        value = value.to_plotly_json()
+    if isinstance(value, dict):
+        return {key: _plotly_json(item) for key, item in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [_plotly_json(item) for item in value]
+    return value
+
+
+def _same_value(first, second):
+    """Compare plot properties that may contain arrays."""
+    if isinstance(first, dict) and isinstance(second, dict):
+        return first.keys() == second.keys() and all(
+            _same_value(first[key], second[key]) for key in first
+        )
+    if isinstance(first, (list, tuple, np.ndarray)) or isinstance(
+        second, (list, tuple, np.ndarray)
+    ):
+        try:
+            return np.array_equal(np.asarray(first), np.asarray(second))
+        except (TypeError, ValueError):
+            return False
+    return first == second
+
+
+def _round_floats(trace, decimals):
+    """Round float arrays to ``decimals`` so that they serialize as short text."""
+    rounded = {}
+    for key, value in _plotly_json(trace).items():
+        if isinstance(value, (list, tuple, np.ndarray)):
+            try:
+                array = np.asarray(value, dtype=float)
+            except (TypeError, ValueError):
+                array = None
+            if array is not None and np.asarray(value).dtype.kind in "fO":
+                value = np.round(array, decimals).tolist()
+                if np.isnan(array).any():
+                    value = np.where(np.isnan(array), None, value).tolist()
+        rounded[key] = value
+    return rounded
+
+
+def _changing_properties(dicts, always=()):
+    """Drop the properties that are equal in all ``dicts``.
+
+    Properties that change are kept in every dict that defines them, because
+    Plotly merges frames into the current state of the figure rather than
+    into the initial one.
+    """
+    keys = set().union(*dicts)
+    constant = {
+        key
+        for key in keys
+        if key not in always
+        and all(key in d for d in dicts)
+        and all(_same_value(dicts[0][key], d[key]) for d in dicts[1:])
+    }
+    return [{k: v for k, v in d.items() if k not in constant} for d in dicts]
+
+
+def _compact_frames(frame_data, frame_layouts):
+    """Reduce slider frames to the properties that differ between them."""
+    frame_data = [[_plotly_json(trace) for trace in data] for data in frame_data]
+    if len({len(data) for data in frame_data}) == 1:
+        by_trace = [
+            _changing_properties(traces, always=("type",))
+            for traces in zip(*frame_data)
+        ]
+        frame_data = [list(traces) for traces in zip(*by_trace)] or [
+            [] for _ in frame_layouts
+        ]
+
+    frame_layouts = [_plotly_json(layout) for layout in frame_layouts]
+    for axis in ("xaxis", "yaxis"):
+        axes = _changing_properties([layout.get(axis, {}) for layout in frame_layouts])
+        for layout, compact_axis in zip(frame_layouts, axes):
+            layout.pop(axis, None)
+            if compact_axis:
+                layout[axis] = compact_axis
+    frame_layouts = _changing_properties(frame_layouts)
+    return frame_data, frame_layouts
+
+
+def slider_plot(
+    figures, *, label="value", initial=None, play=False, compact=True, decimals=None
+):
+    """Create a slider that switches between a set of pre-built figures.
+
+    Parameters
+    ----------
+    figures : dict
+        Mapping from slider values to figures.
+    label : str
+        Slider label, without LaTeX.
+    initial : optional
+        Slider value shown initially, defaults to the first one.
+    play : bool
+        Whether to add a button that animates through the frames.
+    compact : bool
+        Store in each frame only the trace and axis properties that differ
+        between frames, instead of complete figures. The figures must have
+        the same traces in the same order for trace properties to be shared.
+    decimals : int, optional
+        Round the float arrays of the plotted data to this many decimals,
+        which shortens their serialized form.
+    """
     set_default_plotly_template()
     items = list(figures.items())
     if not items:
@@ -358,8 +502,17 @@ def slider_plot(figures, *, label="value", initial=None, play=False):
                     layout["shapes"].append(shp.to_plotly_json())
         return layout
 
+    frame_data = [f.data for _, f in items]
+    frame_layouts = [_frame_layout(f) for _, f in items]
+    base_data = base_fig.data
+    if compact:
+        frame_data, frame_layouts = _compact_frames(frame_data, frame_layouts)
+    if decimals is not None:
+        frame_data = [[_round_floats(t, decimals) for t in data] for data in frame_data]
+        base_data = [_round_floats(t, decimals) for t in base_data]
     frames = [
-        go.Frame(name=str(v), data=f.data, layout=_frame_layout(f)) for v, f in items
+        go.Frame(name=str(v), data=data, layout=layout)
+        for (v, _), data, layout in zip(items, frame_data, frame_layouts)
     ]
     steps = [
         {
@@ -409,7 +562,7 @@ def slider_plot(figures, *, label="value", initial=None, play=False):
                 ],
             }
         )
-    fig = go.Figure(data=base_fig.data, layout=base_fig.layout, frames=frames)
+    fig = go.Figure(data=base_data, layout=base_fig.layout, frames=frames)
     fig.update_xaxes(**base_xaxis)
     fig.update_yaxes(**base_yaxis)
     template_margin = (
@@ -475,6 +628,93 @@ def _faux_label(name):
     return name
 
 
+_ADAPTIVE_TOLERANCE = 2e-3
+_ADAPTIVE_INITIAL_POINTS = 33
+_ADAPTIVE_MAX_POINTS = 1025
+
+
+def _chord_distance(xs, ys, start, stop):
+    """Distance of the points between ``start`` and ``stop`` from their chord.
+
+    Coordinates are normalized to the plot size; the distance is the largest
+    over all bands, and infinite where the energies are not finite.
+    """
+    dx = xs[stop] - xs[start]
+    dy = ys[stop] - ys[start]
+    inner = slice(start + 1, stop)
+    cross = dx * (ys[inner] - ys[start]) - dy * (xs[inner] - xs[start])[:, None]
+    distance = np.abs(cross) / np.sqrt(dx**2 + dy**2)
+    return np.nan_to_num(distance, nan=np.inf).max(axis=-1)
+
+
+def _normalized(xs, energies, y_range):
+    x_span = np.ptp(xs) or 1.0
+    if y_range is None:
+        finite = energies[np.isfinite(energies)]
+        y_range = (finite.min(), finite.max()) if finite.size else (0, 1)
+    y_span = abs(y_range[1] - y_range[0]) or 1.0
+    return xs / x_span, energies / y_span
+
+
+def _decimate(xs, energies, tolerance, y_range=None):
+    """Select the points needed to draw all bands within ``tolerance``.
+
+    Uses the Ramer-Douglas-Peucker algorithm on coordinates normalized to the
+    plot size, shared by all bands. Returns a boolean mask of the points to
+    keep.
+    """
+    xs, ys = _normalized(xs, energies, y_range)
+    keep = np.zeros(len(xs), dtype=bool)
+    keep[[0, -1]] = True
+    segments = [(0, len(xs) - 1)]
+    while segments:
+        start, stop = segments.pop()
+        if stop - start < 2:
+            continue
+        distance = _chord_distance(xs, ys, start, stop)
+        worst = np.argmax(distance)
+        if distance[worst] > tolerance:
+            middle = start + 1 + worst
+            keep[middle] = True
+            segments += [(start, middle), (middle, stop)]
+    return keep
+
+
+def _adaptive_sampling(energies_at, start, stop, tolerance, y_range=None):
+    """Sample bands densely only where they are not approximately straight.
+
+    Intervals next to points that deviate from the chord between their
+    neighbours by more than ``tolerance`` (relative to the plot size) are
+    bisected until the bands are resolved or the maximal number of points is
+    reached. Redundant points are dropped with `_decimate` at the end.
+    """
+    xs = np.linspace(start, stop, _ADAPTIVE_INITIAL_POINTS)
+    energies = energies_at(xs)
+    min_width = abs(stop - start) / (_ADAPTIVE_MAX_POINTS - 1)
+    while len(xs) < _ADAPTIVE_MAX_POINTS:
+        nx, ny = _normalized(xs, energies, y_range)
+        dx = (nx[2:] - nx[:-2])[:, None]
+        dy = ny[2:] - ny[:-2]
+        cross = dx * (ny[1:-1] - ny[:-2]) - dy * (nx[1:-1] - nx[:-2])[:, None]
+        deviation = np.abs(cross) / np.sqrt(dx**2 + dy**2)
+        deviation = np.nan_to_num(deviation, nan=np.inf).max(axis=-1)
+        refine = np.zeros(len(xs) - 1, dtype=bool)
+        refine[:-1] |= deviation > tolerance
+        refine[1:] |= deviation > tolerance
+        refine &= np.abs(np.diff(xs)) > min_width
+        if not refine.any():
+            break
+        new = ((xs[:-1] + xs[1:]) / 2)[refine][: _ADAPTIVE_MAX_POINTS - len(xs)]
+        xs = np.concatenate([xs, new])
+        energies = np.concatenate([energies, energies_at(new)])
+        order = np.argsort(xs)
+        if start > stop:
+            order = order[::-1]
+        xs, energies = xs[order], energies[order]
+    keep = _decimate(xs, energies, tolerance, y_range)
+    return xs[keep], energies[keep]
+
+
 def spectrum(
     syst,
     p=None,
@@ -494,8 +734,21 @@ def spectrum(
     num_bands=None,
     return_energies=False,
     add_zero_line=False,
+    solver="auto",
+    adaptive=False,
 ):
-    """Plot the spectrum of a system using Plotly."""
+    """Plot the spectrum of a system using Plotly.
+
+    If ``num_bands`` is given, only that many bands in the middle of the
+    spectrum are computed and plotted; ``solver`` selects how, see
+    `eigvalsh`.
+
+    For line plots, ``adaptive`` replaces the grid of the varying parameter
+    by adaptive sampling between its first and last values: points are added
+    where the bands bend or cross and dropped where they are straight. Pass a
+    number to set the tolerance relative to the plot size, or ``True`` for
+    the default of about one pixel.
+    """
     set_default_plotly_template()
     if p is None:
         p = dict()
@@ -505,9 +758,33 @@ def spectrum(
     k = [(i if j < dimensionality else 0) for (j, i) in enumerate(k)]
     k_x, k_y, k_z = k
 
-    hamiltonians, variables = hamiltonian_array(syst, p, k_x, k_y, k_z, True)
-    if len(variables) in (1, 2):
-        energies = np.linalg.eigvalsh(hamiltonians)
+    momenta = {"k_x": k_x, "k_y": k_y, "k_z": k_z}
+    changing = [
+        (name, value)
+        for name, value in {**p, **momenta}.items()
+        if isinstance(value, collections.abc.Iterable)
+    ]
+    if adaptive and not return_energies and len(changing) == 1:
+        name, values = changing[0]
+
+        def energies_at(values):
+            arguments = {**momenta, "params": {**p}}
+            if name in momenta:
+                arguments[name] = values
+            else:
+                arguments["params"][name] = values
+            hamiltonians = hamiltonian_array(syst, **arguments)
+            return eigvalsh(hamiltonians, num_bands, solver=solver)
+
+        tolerance = _ADAPTIVE_TOLERANCE if adaptive is True else adaptive
+        xs, energies = _adaptive_sampling(
+            energies_at, values[0], values[-1], tolerance, ylims
+        )
+        variables = [(name, xs)]
+    else:
+        hamiltonians, variables = hamiltonian_array(syst, p, k_x, k_y, k_z, True)
+        if len(variables) in (1, 2):
+            energies = eigvalsh(hamiltonians, num_bands, solver=solver)
 
     if len(variables) == 0:
         raise ValueError("A 0D plot requested")
@@ -564,26 +841,18 @@ def spectrum(
             zlims = (None, None)
 
         kwargs = {
-            "x": np.linspace(*xlims, energies.shape[1]),
-            "y": np.linspace(*ylims, energies.shape[0]),
+            "x": _plot_array(np.linspace(*xlims, energies.shape[1])),
+            "y": _plot_array(np.linspace(*ylims, energies.shape[0])),
         }
-        start, stop = (
-            (0, energies.shape[-1])
-            if num_bands is None
-            else (
-                energies.shape[-1] // 2 - num_bands // 2,
-                energies.shape[-1] // 2 + num_bands // 2,
-            )
-        )
         fig = go.Figure()
         # Use a shared divergent colormap centered at zero for all bands
         max_abs_energy = float(np.nanmax(np.abs(energies)))
         if not np.isfinite(max_abs_energy) or max_abs_energy == 0:
             max_abs_energy = 1.0
         colorscale = "RdBu"
-        for idx in range(start, stop):
+        for idx in range(energies.shape[-1]):
             fig.add_surface(
-                z=energies[:, :, idx],
+                z=_plot_array(energies[:, :, idx]),
                 showscale=False,
                 colorscale=colorscale,
                 opacity=0.85,
@@ -613,16 +882,236 @@ def spectrum(
     raise ValueError("Cannot make 4D plots.")
 
 
+# Below this size the per-matrix ``?syevr`` calls of the subset solver are
+# slower than one batched `numpy.linalg.eigvalsh` (measured with 101 momenta
+# and 4-16 bands).
+_SUBSET_MIN_SIZE = 300
+# Initial shift of the sparse solver, away from zero, where edge states often
+# make the Hamiltonian exactly singular.
+_SPARSE_SHIFT = 1e-6
+_SPARSE_MAX_SHIFTS = 100
+
+
+def _band_window(size, num_bands):
+    """Indices of ``num_bands`` bands in the middle of a spectrum."""
+    if num_bands is None or num_bands >= size:
+        return 0, size
+    return size // 2 - num_bands // 2, size // 2 + num_bands // 2
+
+
+def _sparse_window(hamiltonian, start, stop):
+    """Eigenvalues ``start`` to ``stop - 1`` of a Hermitian matrix.
+
+    The LU factorization of ``H - shift`` without off-diagonal pivoting gives
+    the number of eigenvalues below the shift (Sylvester's law of inertia).
+    The shift is bisected until it lies inside the window, and the missing
+    eigenvalues right below and right above it are then found with
+    shift-invert Lanczos, reusing the same factorization.
+    """
+    size = hamiltonian.shape[0]
+    hamiltonian = sparse.csc_matrix(hamiltonian)
+    identity = sparse.identity(size, format="csc")
+    bound = abs(hamiltonian).sum(axis=1).max()
+    lower, upper = -bound, bound
+    shift = _SPARSE_SHIFT
+    for _ in range(_SPARSE_MAX_SHIFTS):
+        try:
+            lu = sla.splu(
+                hamiltonian - shift * identity,
+                permc_spec="MMD_AT_PLUS_A",
+                diag_pivot_thresh=0,
+                options=dict(SymmetricMode=True),
+            )
+        except RuntimeError:  # exactly singular
+            shift += _SPARSE_SHIFT
+            continue
+        below = np.count_nonzero(lu.U.diagonal().real < 0)
+        if start <= below <= stop:
+            break
+        if below < start:
+            lower = shift
+        else:
+            upper = shift
+        shift = (lower + upper) / 2
+    else:
+        raise RuntimeError("The sparse eigenvalue solver did not find the bands.")
+
+    inverse = sla.LinearOperator((size, size), lu.solve, dtype=hamiltonian.dtype)
+    energies = []
+    # In shift-invert mode, the eigenvalues closest to the shift from below
+    # (above) are the smallest (largest) ones of the inverse.
+    for num, which in [(below - start, "SA"), (stop - below, "LA")]:
+        if num:
+            energies.append(
+                sla.eigsh(
+                    hamiltonian,
+                    k=num,
+                    sigma=shift,
+                    OPinv=inverse,
+                    which=which,
+                    return_eigenvectors=False,
+                )
+            )
+    return np.sort(np.concatenate(energies))
+
+
+def eigvalsh(hamiltonians, num_bands=None, *, solver="auto"):
+    """Compute eigenvalues of a stack of Hermitian matrices.
+
+    Parameters
+    ----------
+    hamiltonians : array of shape (..., n, n)
+    num_bands : int, optional
+        Number of eigenvalues to keep in the middle of the spectrum. All
+        eigenvalues are returned if not provided.
+    solver : {"auto", "dense", "subset", "sparse"}
+        ``"dense"`` diagonalizes the whole stack with `numpy.linalg.eigvalsh`
+        and then slices it. ``"subset"`` computes only the requested range of
+        indices with LAPACK ``?syevr``. ``"sparse"`` uses shift-invert
+        Lanczos, which only pays off for large matrices with few nonzero
+        elements. ``"auto"`` chooses between ``"dense"`` and ``"subset"``
+        based on the matrix size. All solvers return the same bands.
+
+    Returns
+    -------
+    energies : array of shape (..., num_bands)
+        Sorted eigenvalues of every matrix.
+    """
+    hamiltonians = np.asarray(hamiltonians)
+    size = hamiltonians.shape[-1]
+    start, stop = _band_window(size, num_bands)
+    if solver == "auto":
+        if stop - start == size or size < _SUBSET_MIN_SIZE:
+            solver = "dense"
+        else:
+            solver = "subset"
+
+    if solver == "dense":
+        return np.linalg.eigvalsh(hamiltonians)[..., start:stop]
+
+    stack = hamiltonians.reshape(-1, size, size)
+    if solver == "subset":
+        energies = [
+            la.eigh(
+                h,
+                eigvals_only=True,
+                subset_by_index=(start, stop - 1),
+                driver="evr",
+            )
+            for h in stack
+        ]
+    elif solver == "sparse":
+        if stop - start == size:
+            raise ValueError("The sparse solver requires num_bands < matrix size.")
+        energies = [_sparse_window(h, start, stop) for h in stack]
+    else:
+        raise ValueError(f"Unknown eigenvalue solver: {solver}")
+    return np.array(energies).reshape(hamiltonians.shape[:-2] + (stop - start,))
+
+
 def h_k(syst, p, momentum):
     """Function that returns the Hamiltonian of a kwant 1D system as a momentum."""
     return hamiltonian_array(syst, p, momentum)[0]
 
 
-def hamiltonian_array(syst, params=None, k_x=0, k_y=0, k_z=0, return_grid=False):
-    """Evaluate the Hamiltonian of a system over a grid of parameters."""
-    # Prevent accidental mutation of input
-    params = copy(params)
+def _available_cpus():
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:
+        return os.cpu_count() or 1
 
+
+def _default_workers():
+    """Number of worker processes used when none is given.
+
+    The ``COURSE_WORKERS`` environment variable takes precedence, so that
+    notebooks executed side by side do not each use every CPU.
+    """
+    try:
+        return max(1, int(os.environ["COURSE_WORKERS"]))
+    except (KeyError, ValueError):
+        return _available_cpus()
+
+
+_sweep_function = None
+
+
+def _init_sweep_worker(func):
+    global _sweep_function
+    _sweep_function = func
+
+
+def _call_sweep_function(value):
+    return _sweep_function(value)
+
+
+@contextlib.contextmanager
+def _forked_pool(func, workers):
+    """Pool of forked workers evaluating ``func`` via `_call_sweep_function`.
+
+    Yields ``None`` if the work should instead be done in this process.
+    """
+    if workers <= 1 or "fork" not in multiprocessing.get_all_start_methods():
+        yield None
+        return
+
+    context = multiprocessing.get_context("fork")
+    with warnings.catch_warnings():
+        # The workers only run ``func`` and never touch the kernel threads.
+        warnings.filterwarnings(
+            "ignore",
+            message=".*fork\\(\\) may lead to deadlocks",
+            category=DeprecationWarning,
+        )
+        with concurrent.futures.ProcessPoolExecutor(
+            workers,
+            mp_context=context,
+            initializer=_init_sweep_worker,
+            initargs=(func,),
+        ) as executor:
+            yield executor
+
+
+def sweep(func, grid, *, workers=None):
+    """Evaluate ``func`` for every value of ``grid`` in a pool of processes.
+
+    Parameters
+    ----------
+    func : callable
+        Function of a single grid value, for example
+        ``lambda B: spectrum(syst, {**params, "B": B})``. It does not need to
+        be picklable: the workers are forked, so ``func`` and everything it
+        refers to (such as Kwant systems) reach each worker exactly once.
+    grid : iterable
+        Values to evaluate ``func`` at.
+    workers : int, optional
+        Number of worker processes, defaults to ``COURSE_WORKERS`` or else the
+        number of available CPUs. With a single worker, or where forking is
+        unavailable, the values are evaluated serially in the current process.
+
+    Returns
+    -------
+    results : dict
+        Mapping from each grid value to its result, in the order of ``grid``,
+        ready to be passed to `slider_plot`.
+    """
+    grid = list(grid)
+    if workers is None:
+        workers = _default_workers()
+    with _forked_pool(func, min(workers, len(grid))) as executor:
+        if executor is None:
+            results = [func(value) for value in grid]
+        else:
+            results = list(executor.map(_call_sweep_function, grid))
+    return dict(zip(grid, results))
+
+
+def _momentum_to_lattice(syst):
+    """Return a function mapping Cartesian momenta to lattice momenta of ``syst``.
+
+    The returned function accepts an array of shape ``(..., 3)`` and returns the
+    lattice momenta as an array of shape ``(..., dimensionality)``.
+    """
     try:
         space_dimensionality = syst.symmetry.periods.shape[-1]
     except AttributeError:
@@ -630,40 +1119,186 @@ def hamiltonian_array(syst, params=None, k_x=0, k_y=0, k_z=0, return_grid=False)
     dimensionality = syst.symmetry.num_directions
 
     if dimensionality == 0:
-        syst = syst.finalized()
 
         def momentum_to_lattice(k):
-            return {}
+            return np.zeros(np.shape(k)[:-1] + (0,))
+
+    elif len(syst.symmetry.periods) == 1:
+
+        def momentum_to_lattice(k):
+            k = np.asarray(k)
+            if np.any(k[..., dimensionality:]):
+                raise ValueError("Dispersion is 1D, but more momenta are provided.")
+            return k[..., :1]
 
     else:
-        if len(syst.symmetry.periods) == 1:
+        B = np.array(syst.symmetry.periods).T
+        A = B @ np.linalg.inv(B.T @ B)
 
-            def momentum_to_lattice(k):
-                if any(k[dimensionality:]):
-                    raise ValueError("Dispersion is 1D, but more momenta are provided.")
-                return {"k_x": k[0]}
+        def momentum_to_lattice(k):
+            k = np.asarray(k)
+            shape = k.shape[:-1]
+            rhs = k.reshape(-1, k.shape[-1])[:, :space_dimensionality].T
+            lstsq = np.linalg.lstsq(A, rhs, rcond=-1)
+            k, residuals = lstsq[:2]
+            if np.any(abs(residuals) > 1e-7):
+                raise RuntimeError(
+                    "Requested momentum doesn't correspond to any lattice momentum."
+                )
+            return k.T.reshape(shape + (dimensionality,))
+
+    return momentum_to_lattice
+
+
+_SYSTEM_CACHE_SIZE = 32
+_system_cache = collections.OrderedDict()
+
+
+def _fingerprint(syst):
+    """Summarize the structure of a builder to detect mutations."""
+    return hash(
+        (
+            tuple(np.ravel(syst.symmetry.periods)),
+            len(syst.H),
+            tuple((site, id(value)) for site, value in syst.site_value_pairs()),
+            tuple((hop, id(value)) for hop, value in syst.hopping_value_pairs()),
+        )
+    )
 
-        else:
-            B = np.array(syst.symmetry.periods).T
-            A = B @ np.linalg.inv(B.T @ B)
 
-            def momentum_to_lattice(k):
-                lstsq = np.linalg.lstsq(A, k[:space_dimensionality], rcond=-1)
-                k, residuals = lstsq[:2]
-                if np.any(abs(residuals) > 1e-7):
-                    raise RuntimeError(
-                        "Requested momentum doesn't correspond to any lattice momentum."
-                    )
-                return dict(zip(["k_x", "k_y", "k_z"], list(k)))
+def _wrapped_system(syst):
+    """Finalize ``syst`` with all its translational symmetries wrapped around.
+
+    Finalized systems are cached per builder, together with the derived
+    quantities needed by `hamiltonian_array`. A cached entry is reused only if
+    the builder structure is unchanged; use `clear_system_cache` after
+    modifying values in place (for example arrays used as onsite values).
+    """
+    key = id(syst)
+    fingerprint = _fingerprint(syst)
+    entry = _system_cache.get(key)
+    if (
+        entry is not None
+        and entry.builder() is syst
+        and entry.fingerprint == fingerprint
+    ):
+        _system_cache.move_to_end(key)
+        return entry
+
+    dimensionality = syst.symmetry.num_directions
+    if dimensionality == 0:
+        fsyst = syst.finalized()
+    else:
+        fsyst = kwant.wraparound.wraparound(syst).finalized()
+    entry = SimpleNamespace(
+        builder=weakref.ref(syst),
+        fingerprint=fingerprint,
+        fsyst=fsyst,
+        momentum_to_lattice=_momentum_to_lattice(syst),
+        hopping_range=_hopping_range(syst) if dimensionality else None,
+        depends_on_momentum=_depends_on_momentum(syst),
+    )
+    _system_cache[key] = entry
+    while len(_system_cache) > _SYSTEM_CACHE_SIZE:
+        _system_cache.popitem(last=False)
+    return entry
+
+
+def clear_system_cache(syst=None):
+    """Forget the finalized versions of ``syst``, or of all systems if omitted."""
+    if syst is None:
+        _system_cache.clear()
+    else:
+        _system_cache.pop(id(syst), None)
 
-        syst = kwant.wraparound.wraparound(syst).finalized()
+
+def _depends_on_momentum(syst):
+    """Check whether any value function of ``syst`` takes a momentum parameter."""
+    values = itertools.chain(
+        (value for _, value in syst.site_value_pairs()),
+        (value for _, value in syst.hopping_value_pairs()),
+    )
+    for value in values:
+        if not callable(value):
+            continue
+        try:
+            parameters = inspect.signature(value).parameters.values()
+        except (TypeError, ValueError):
+            return True
+        for parameter in parameters:
+            if parameter.kind is parameter.VAR_KEYWORD:
+                return True
+            if parameter.name in ("k_x", "k_y", "k_z"):
+                return True
+    return False
+
+
+def _hopping_range(syst):
+    """Largest number of unit cells crossed by a hopping along each direction."""
+    dimensionality = syst.symmetry.num_directions
+    which = syst.symmetry.which
+    elements = [which(b) - which(a) for a, b in syst.hoppings()]
+    if not elements:
+        return np.zeros(dimensionality, dtype=int)
+    return np.max(np.abs(np.array(elements, dtype=int)), axis=0)
+
+
+def _bloch_components(fsyst, params, hopping_range):
+    """Decompose the Bloch Hamiltonian into its Fourier components.
+
+    A wrapped system without momentum-dependent value functions has
+    ``H(k) = Σ_R H_R exp(i k·R)``, with integer lattice vectors ``R`` bounded by
+    ``hopping_range``. Sampling ``H(k)`` on a grid with ``2 * hopping_range + 1``
+    points per direction therefore determines every ``H_R`` exactly.
+
+    Returns
+    -------
+    lattice_vectors : array of shape (n_R, dimensionality)
+    blocks : array of shape (n_R, n_orbs, n_orbs)
+    """
+    lattice_vectors = np.array(
+        list(itertools.product(*(range(-r, r + 1) for r in hopping_range))),
+        dtype=float,
+    )
+    num_samples = 2 * np.asarray(hopping_range) + 1
+    samples = np.array(list(itertools.product(*(range(n) for n in num_samples))))
+    samples = 2 * np.pi * samples / num_samples
+    names = ["k_x", "k_y", "k_z"][: len(hopping_range)]
+    hamiltonians = np.array(
+        [
+            fsyst.hamiltonian_submatrix(
+                params={**params, **dict(zip(names, k))}, sparse=False
+            )
+            for k in samples
+        ]
+    )
+    phases = np.exp(-1j * samples @ lattice_vectors.T) / len(samples)
+    blocks = np.tensordot(phases.T, hamiltonians, axes=1)
+    return lattice_vectors, blocks
+
+
+def hamiltonian_array(syst, params=None, k_x=0, k_y=0, k_z=0, return_grid=False):
+    """Evaluate the Hamiltonian of a system over a grid of parameters.
+
+    For systems with translational symmetry, the Bloch Hamiltonian is
+    decomposed into Fourier components once per set of the remaining
+    parameters and then summed over the whole momentum grid at once. Systems
+    whose value functions depend on momentum explicitly are evaluated point by
+    point instead.
+    """
+    # Prevent accidental mutation of input
+    params = copy(params) if params is not None else dict()
+
+    wrapped = _wrapped_system(syst)
+    syst, momentum_to_lattice = wrapped.fsyst, wrapped.momentum_to_lattice
 
     changing = dict()
     for key, value in params.items():
         if isinstance(value, collections.abc.Iterable):
             changing[key] = value
 
-    for key, value in [("k_x", k_x), ("k_y", k_y), ("k_z", k_z)]:
+    momenta = {"k_x": k_x, "k_y": k_y, "k_z": k_z}
+    for key, value in momenta.items():
         if key in changing:
             raise RuntimeError(
                 "One of the system parameters is {}, "
@@ -676,22 +1311,62 @@ def hamiltonian_array(syst, params=None, k_x=0, k_y=0, k_z=0, return_grid=False)
     def hamiltonian(**values):
         k = [values.pop("k_x", k_x), values.pop("k_y", k_y), values.pop("k_z", k_z)]
         params.update(values)
-        k = momentum_to_lattice(k)
+        k = dict(zip(["k_x", "k_y", "k_z"], momentum_to_lattice(k)))
         system_params = {**params, **k}
         return syst.hamiltonian_submatrix(params=system_params, sparse=False)
 
     names, values = zip(*sorted(changing.items())) if changing else ([], [])
-
-    hamiltonians = (
-        [hamiltonian(**dict(zip(names, value))) for value in itertools.product(*values)]
-        if changing
-        else [hamiltonian(k_x=k_x, k_y=k_y, k_z=k_z)]
+    shape = [len(value) for value in values]
+
+    momentum_names = [name for name in names if name in momenta]
+    other_names = [name for name in names if name not in momenta]
+    num_momenta = math.prod(len(changing[name]) for name in momentum_names)
+    hopping_range = wrapped.hopping_range
+    vectorize = (
+        momentum_names
+        and num_momenta > math.prod(2 * hopping_range + 1)
+        and not wrapped.depends_on_momentum
     )
-    size = list(hamiltonians[0].shape)
 
-    hamiltonians = np.array(hamiltonians).reshape(
-        [len(value) for value in values] + size
-    )
+    if vectorize:
+        grid = np.meshgrid(
+            *(
+                np.asarray(changing[key]) if key in changing else np.asarray([value])
+                for key, value in momenta.items()
+            ),
+            indexing="ij",
+        )
+        lattice_momenta = momentum_to_lattice(
+            np.stack([k.ravel() for k in grid], axis=-1)
+        )
+        hamiltonians = []
+        for value in itertools.product(*(changing[name] for name in other_names)):
+            params.update(zip(other_names, value))
+            lattice_vectors, blocks = _bloch_components(syst, params, hopping_range)
+            phases = np.exp(1j * lattice_momenta @ lattice_vectors.T)
+            hamiltonians.append(np.tensordot(phases, blocks, axes=1))
+        size = list(blocks.shape[1:])
+        order = other_names + momentum_names
+        hamiltonians = np.array(hamiltonians).reshape(
+            [len(changing[name]) for name in order] + size
+        )
+        hamiltonians = np.moveaxis(
+            hamiltonians,
+            list(range(len(order))),
+            [names.index(name) for name in order],
+        )
+    else:
+        hamiltonians = (
+            [
+                hamiltonian(**dict(zip(names, value)))
+                for value in itertools.product(*values)
+            ]
+            if changing
+            else [hamiltonian(k_x=k_x, k_y=k_y, k_z=k_z)]
+        )
+        size = list(hamiltonians[0].shape)
+
+        hamiltonians = np.array(hamiltonians).reshape(shape + size)
 
     if return_grid:
         return hamiltonians, list(zip(names, values))
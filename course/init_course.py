@@ -1,19 +1,33 @@
+"""Notebook setup for the course.
+
+Importing this module and calling `init_notebook` is cheap: `course.functions`,
+Kwant and Plotly are only imported when one of their names is first used, and
+the Plotly and Matplotlib configuration is deferred until those packages are
+imported.
+
+Cold start budget: in a fresh kernel, where IPython and NumPy are loaded,
+``from course.init_course import init_notebook; init_notebook()`` must not
+import Kwant, Plotly or Matplotlib and should take well below 0.1 s.
+``scripts/check_import_time.py`` (``pixi run check-import-time``) enforces
+this. Importing `course.functions` afterwards adds about 0.3 s, nearly all of
+it Kwant, which every notebook needs.
+"""
+
 # 1. Standard library imports
 import datetime
+import importlib.abc
+import importlib.metadata
+import importlib.util
 import os
 import re
 import sys
 import warnings
 
 # 2. External package imports
-import kwant
-import matplotlib
 import numpy as np
-import plotly
-from IPython import display, get_ipython
-from IPython.display import HTML
 
-from . import functions
+# 3. Internal imports
+from . import _functions_all
 
 init_course = [
     "init_notebook",
@@ -22,10 +36,20 @@ init_course = [
     "pretty_fmt_complex",
 ]
 
-__all__ = init_course + functions.__all__
 
-for _name in functions.__all__:
-    globals()[_name] = getattr(functions, _name)
+def __getattr__(name):
+    # Names of `course.functions` are re-exported on first use (PEP 562).
+    # Other dunder names, such as ``__path__`` that the import system looks
+    # up, must not import it.
+    if name.startswith("__") and name != "__all__":
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    if name == "__all__":
+        return init_course + list(_functions_all)
+    if name in _functions_all:
+        from . import functions
+
+        return getattr(functions, name)
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
 
 
 # Adjust printing of matrices, and numpy printing of numbers.
@@ -37,6 +61,8 @@ def pprint_matrix(data, digits=3):
     d = d.replace("\n", r"\\")
     d = re.sub(r" *\[ *", "", d)
     d = re.sub(r" +", " & ", d)
+    from IPython import display
+
     display.display_latex(display.Latex(header.format(d=d)))
 
 
@@ -64,10 +90,11 @@ def print_information():
         "Populated the namespace with:\n"
         + ", ".join(init_course)
         + "\nfrom course.functions:\n"
-        + ", ".join(functions.__all__)
+        + ", ".join(_functions_all)
     )
 
-    print(f"Using kwant {kwant.__version__} and plotly {plotly.__version__}")
+    versions = {name: importlib.metadata.version(name) for name in ("kwant", "plotly")}
+    print("Using kwant {kwant} and plotly {plotly}".format(**versions))
 
     now = datetime.datetime.now()
     print("Executed on {} at {}.".format(now.date(), now.time()))
@@ -77,44 +104,32 @@ def check_versions():
     if sys.version_info < (3, 10):
         raise Exception("Install Python 3.10 or higher, we recommend using pixi.")
 
-    if tuple(int(part) for part in kwant.__version__.split(".")[:2]) < (1, 5):
+    kwant_version = importlib.metadata.version("kwant")
+    if tuple(int(part) for part in kwant_version.split(".")[:2]) < (1, 5):
         raise Exception(
             "Install kwant 1.5 or higher. If you are using conda, do: `conda install -c conda-forge kwant`"
         )
 
 
-def init_notebook():
-    print_information()
-    check_versions()
+MATHJAX_LOADER = """
+<script type="text/javascript">
+if (!window.MathJax) {
+  var script = document.createElement("script");
+  script.type = "text/javascript";
+  script.src = "https://cdn.jsdelivr.net/npm/mathjax@3/es5/tex-mml-chtml.js";
+  document.head.appendChild(script);
+}
+</script>
+"""
 
-    functions.set_default_plotly_template()
 
-    # Ensure MathJax is available for Plotly LaTeX rendering in all contexts.
-    mathjax_loader = """
-    <script type="text/javascript">
-    if (!window.MathJax) {
-      var script = document.createElement("script");
-      script.type = "text/javascript";
-      script.src = "https://cdn.jsdelivr.net/npm/mathjax@3/es5/tex-mml-chtml.js";
-      document.head.appendChild(script);
-    }
-    </script>
-    """
-    display.display(HTML(mathjax_loader))
+def _setup_matplotlib():
+    import matplotlib
+    from IPython import get_ipython
 
     # Enable inline plotting in the notebook
     get_ipython().enable_matplotlib(gui="inline")
 
-    np.set_printoptions(
-        precision=2, suppress=True, formatter={"complexfloat": pretty_fmt_complex}
-    )
-
-    # Silence Kwant warnings from color scale overflow
-    warnings.filterwarnings(
-        "ignore",
-        category=RuntimeWarning,
-        message="The plotted data contains",
-    )
     # Already fixed in newer Kwant versions
     warnings.filterwarnings(
         "ignore",
@@ -129,3 +144,92 @@ def init_notebook():
 
     code_dir = os.path.dirname(os.path.realpath(__file__))
     matplotlib.rc_file(os.path.join(code_dir, "matplotlibrc"))
+
+
+class _PostImportHook(importlib.abc.MetaPathFinder):
+    """Call ``callback`` once, right after the module ``name`` is imported."""
+
+    def __init__(self, name, callback):
+        self.name = name
+        self.callback = callback
+
+    def find_spec(self, fullname, path, target=None):
+        if fullname != self.name:
+            return None
+        sys.meta_path.remove(self)
+        spec = importlib.util.find_spec(fullname)
+        if spec is None or spec.loader is None:
+            return spec
+        exec_module = spec.loader.exec_module
+
+        def exec_and_call(module):
+            exec_module(module)
+            self.callback()
+
+        spec.loader.exec_module = exec_and_call
+        return spec
+
+
+def _when_imported(name, callback):
+    """Call ``callback`` now if ``name`` is imported, otherwise once it is."""
+    if name in sys.modules:
+        callback()
+    else:
+        sys.meta_path.insert(0, _PostImportHook(name, callback))
+
+
+def _set_plotly_template():
+    from . import functions
+
+    functions.set_default_plotly_template()
+
+
+def _show_mathjax_once(formatter, figure_type):
+    """Load MathJax together with the first Plotly figure displayed.
+
+    ``figure_type`` is given as ``"module.name"``, so that registering does
+    not import Plotly.
+    """
+
+    def show(figure):
+        from IPython import display
+
+        formatter.pop(figure_type, None)
+        display.display(display.HTML(MATHJAX_LOADER))
+        figure._ipython_display_()
+
+    formatter.for_type_by_name(*figure_type.rsplit(".", 1), show)
+
+
+def init_notebook():
+    """Print the environment, check versions and configure the notebook.
+
+    Setting the Plotly template is postponed until Plotly is imported,
+    loading MathJax until the first Plotly figure is shown, and configuring
+    Matplotlib until Matplotlib is imported, for example by `kwant.plot`.
+    """
+    from IPython import get_ipython
+
+    print_information()
+    check_versions()
+
+    _when_imported("plotly", _set_plotly_template)
+
+    # Ensure MathJax is available for Plotly LaTeX rendering in all contexts.
+    _show_mathjax_once(
+        get_ipython().display_formatter.ipython_display_formatter,
+        "plotly.basedatatypes.BaseFigure",
+    )
+
+    np.set_printoptions(
+        precision=2, suppress=True, formatter={"complexfloat": pretty_fmt_complex}
+    )
+
+    # Silence Kwant warnings from color scale overflow
+    warnings.filterwarnings(
+        "ignore",
+        category=RuntimeWarning,
+        message="The plotted data contains",
+    )
+
+    _when_imported("matplotlib", _setup_matplotlib)
@@ -33,10 +33,15 @@ NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
 SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
 """
 
+from collections.abc import Sequence
+
 import numpy as np
 import plotly.graph_objects as go
 from numpy.linalg import norm
 from scipy import linalg as la
+from scipy import optimize
+from scipy import sparse
+from scipy.sparse import linalg as sla
 
 hex2dbasis = (np.array([1.0, 0]), np.array([0.5, np.sqrt(3.0) / 2.0]))
 hex2dbonds = [((0, 0), (1, 0)), ((0, 0), (0, 1)), ((0, 0), (-1, 1))]
@@ -79,12 +84,92 @@ class Bond:
         return self.__str__()
 
 
+class _MeshBond(Bond):
+    """Bond whose attributes are stored in the arrays of a `Mesh`."""
+
+    def __init__(self, mesh, index):
+        self._mesh = mesh
+        self._index = index
+
+    def _array_property(name, column=None):
+        key = (lambda i: i) if column is None else (lambda i: (i, column))
+
+        def get(self):
+            return getattr(self._mesh, name)[key(self._index)]
+
+        def set(self, value):
+            getattr(self._mesh, name)[key(self._index)] = value
+
+        return property(get, set)
+
+    p1 = _array_property("bond_pairs", 0)
+    p2 = _array_property("bond_pairs", 1)
+    k = _array_property("bond_k")
+    l0 = _array_property("bond_l0")
+    color = _array_property("bond_colors")
+    del _array_property
+
+
+class _BondView(Sequence):
+    """Read-only sequence of the bonds of a `Mesh` as `Bond` objects.
+
+    The bond attributes can be modified through the items, but bonds can
+    only be added with `Mesh.add_bond` and `Mesh.add_bonds`.
+    """
+
+    def __init__(self, mesh):
+        self._mesh = mesh
+
+    def __len__(self):
+        return len(self._mesh.bond_pairs)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(len(self)))]
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError("bond index out of range")
+        return _MeshBond(self._mesh, index)
+
+
+def _buffered_array(name):
+    """Array attribute stored with spare capacity, see `Mesh._extend`."""
+
+    def get(self):
+        return self._buffers[name][: self._sizes[name]]
+
+    def set(self, value):
+        self._buffers[name] = np.asarray(value)
+        self._sizes[name] = len(self._buffers[name])
+
+    return property(get, set)
+
+
 class Mesh:
+    """Points connected by bonds, stored as arrays.
+
+    ``Points`` is an (N, dim) array of positions, ``bond_pairs`` an (M, 2)
+    array with the points connected by every bond, and ``bond_k``,
+    ``bond_l0`` and ``bond_colors`` hold the remaining bond properties.
+    ``Bonds`` gives a read-only view of the same data as `Bond` objects.
+    The arrays grow geometrically, so adding points and bonds one at a time
+    takes linear time overall.
+    """
+
+    Points = _buffered_array("Points")
+    bond_pairs = _buffered_array("bond_pairs")
+    bond_k = _buffered_array("bond_k")
+    bond_l0 = _buffered_array("bond_l0")
+
     def __init__(self, dim=2, L=None):
-        self.Points = []
-        self.Bonds = []
-        self.N = 0
-        self.nbrinfo = []
+        self._buffers = {}
+        self._sizes = {}
+        self.Points = np.zeros((0, dim))
+        self.bond_pairs = np.zeros((0, 2), dtype=int)
+        self.bond_k = np.zeros(0)
+        self.bond_l0 = np.zeros(0)
+        self.bond_colors = []
         self.L = L
         self.dim = dim
         self.dislocations = []
@@ -93,42 +178,100 @@ class Mesh:
         if len(self.L) != dim:
             print("error: box lengths must be of correct dimension")
 
+    def _extend(self, name, values):
+        """Append ``values`` to a buffered array, doubling its capacity if full."""
+        buffer, size = self._buffers[name], self._sizes[name]
+        end = size + len(values)
+        if end > len(buffer):
+            grown = np.empty(
+                (max(end, 2 * len(buffer)),) + buffer.shape[1:], buffer.dtype
+            )
+            grown[:size] = buffer[:size]
+            self._buffers[name] = buffer = grown
+        buffer[size:end] = values
+        self._sizes[name] = end
+
+    @property
+    def N(self):
+        return len(self.Points)
+
+    @property
+    def Bonds(self):
+        return _BondView(self)
+
+    @property
+    def neighbors(self):
+        """Neighbours of the points along bonds with two-letter colors.
+
+        A bond from ``p1`` to ``p2`` with color ``"ab"`` makes ``p2`` the
+        ``"b"`` neighbour of ``p1`` and ``p1`` the ``"a"`` neighbour of
+        ``p2``; later bonds take precedence.
+
+        :returns: Dict from direction to an array with the neighbour of every
+            point in that direction, or -1 if there is none.
+        """
+        colors = np.array(self.bond_colors, dtype=str)
+        paired = np.flatnonzero(np.char.str_len(colors) == 2)
+        p1, p2 = self.bond_pairs[paired].T
+        first, second = colors[paired].astype("U2").view("U1").reshape(-1, 2).T
+        # Both ends of the bonds, latest bond first.
+        points = np.concatenate([p1, p2])[::-1]
+        others = np.concatenate([p2, p1])[::-1]
+        directions = np.concatenate([second, first])[::-1]
+        result = {}
+        for direction in np.unique(directions):
+            mine = directions == direction
+            table = np.full(self.N, -1)
+            unique, first = np.unique(points[mine], return_index=True)
+            table[unique] = others[mine][first]
+            result[str(direction)] = table
+        return result
+
     def points(self):
         return np.array(self.Points)
 
     def bonds(self):
-        return np.array([[bd.p1, bd.p2] for bd in self.Bonds])
+        return np.array(self.bond_pairs)
+
+    def add_points(self, points):
+        points = np.asarray(points, dtype=float).reshape(-1, self.dim)
+        self._extend("Points", points)
 
     def add_point(self, point):
-        self.Points.append(point)
-        self.nbrinfo.append(dict([]))
-        self.N += 1
+        self.add_points(point)
+
+    def add_bonds(self, p1, p2, color="r", k=1.0, l0=1.0):
+        """Add bonds between the points with indices in ``p1`` and ``p2``."""
+        p1, p2 = np.broadcast_arrays(np.atleast_1d(p1), np.atleast_1d(p2))
+        num = len(p1)
+        self._extend("bond_pairs", np.stack([p1, p2], 1))
+        self._extend("bond_k", np.broadcast_to(k, num))
+        self._extend("bond_l0", np.broadcast_to(l0, num))
+        self.bond_colors.extend([color] * num)
 
     def append_bond(self, bond):
-        self.Bonds.append(bond)
+        self.add_bonds(bond.p1, bond.p2, bond.color, k=bond.k, l0=bond.l0)
 
     def add_bond(self, p1, p2=None, color="r", k=1.0, l0=1.0):
         if p2 is None:
-            self.append_bond(p1, k=k, l0=l0)
+            self.append_bond(p1)
         else:
-            self.append_bond(Bond(p1, p2, color, k=k, l0=l0))
-
-        if len(color) == 2:
-            self.nbrinfo[p1][color[1]] = p2
-            self.nbrinfo[p2][color[0]] = p1
+            self.add_bonds(p1, p2, color, k=k, l0=l0)
 
     def dr(self, p1, p2=None):
+        """Minimum image vector from point ``p1`` to point ``p2``.
+
+        ``p1`` may also be a `Bond`, and both may be arrays of point indices,
+        in which case an array with one vector per pair is returned.
+        """
         if p2 is None:
             p2 = p1.p2
             p1 = p1.p1
         dx = self.Points[p2] - self.Points[p1]
-        for i in range(self.dim):
-            dx[i] = (
-                dx[i]
-                if abs(dx[i]) < 0.5 * self.L[i]
-                else dx[i] - abs(dx[i] + 0.5 * self.L[i]) + abs(dx[i] - 0.5 * self.L[i])
-            )
-        return dx
+        half = 0.5 * np.asarray(self.L, dtype=float)
+        return np.where(
+            np.abs(dx) < half, dx, dx - np.abs(dx + half) + np.abs(dx - half)
+        )
 
 
 def klbasis(x1, x2, x3, z=0):
@@ -167,6 +310,17 @@ def klbasispoints(x1, x2, x3, z=0):
     return [p1, p2, p3]
 
 
+def _segments(start, end):
+    """Plotly line coordinates of segments from ``start`` to ``end``.
+
+    The segments are separated by NaN, which Plotly draws as gaps.
+    """
+    xy = np.full((len(start), 3, 2), np.nan)
+    xy[:, 0] = start
+    xy[:, 1] = end
+    return xy[..., 0].ravel(), xy[..., 1].ravel()
+
+
 def vis2d(
     mesh,
     draw_points=False,
@@ -187,21 +341,15 @@ def vis2d(
 
     cutoff = mesh.lx / 2 if mesh.lx < mesh.ly else mesh.ly / 2
 
-    x_lines = []
-    y_lines = []
-    for bd in mesh.Bonds:
-        if norm(pts[bd.p1] - pts[bd.p2]) < cutoff:
-            x_lines.extend([pts[bd.p1][0], pts[bd.p2][0], None])
-            y_lines.extend([pts[bd.p1][1], pts[bd.p2][1], None])
+    p1, p2 = np.asarray(mesh.bond_pairs).T
+    short = norm(pts[p1] - pts[p2], axis=1) < cutoff
+    x_lines, y_lines = _segments(pts[p1[short]], pts[p2[short]])
 
-    x_arrows = []
-    y_arrows = []
     if eigenfunction is not None:
-        disp = eigenfunction[:lenmode].reshape(len(pts), 2)
-        disp *= kwargs.get("scale", 1)
-        for pt, d in zip(pts, disp):
-            x_arrows.extend([pt[0], pt[0] + d[0], None])
-            y_arrows.extend([pt[1], pt[1] + d[1], None])
+        disp = np.reshape(eigenfunction[:lenmode], (len(pts), 2))
+        x_arrows, y_arrows = _segments(pts, pts + kwargs.get("scale", 1) * disp)
+    else:
+        x_arrows, y_arrows = _segments(np.zeros((0, 2)), np.zeros((0, 2)))
 
     def _rgba(color):
         if isinstance(color, tuple) and len(color) == 4:
@@ -256,9 +404,7 @@ def vis2d(
 def periodicize(mesh, L, eps=0.101231):
     mesh += np.ones_like(L) * eps
     L = np.array(L)
-    for pt in mesh:
-        wrap = np.round((pt - L / 2) / L)
-        pt -= wrap * L
+    mesh -= np.round((mesh - L / 2) / L) * L
     mesh -= np.ones_like(L) * eps
 
 
@@ -280,50 +426,53 @@ def makeLattice(
     if boundaryshift is not None:
         boundaryshift = np.array(boundaryshift)
 
+    strides = np.array([np.prod(n[i + 1 :]) for i in range(dim)])
+
     def idx(latticept, basisidx):
-        internalidx = sum([latticept[i] * np.prod(n[i + 1 :]) for i in range(dim)])
-        return int(internalidx + basisidx * np.prod(n))
+        internalidx = latticept @ strides
+        return (internalidx + basisidx * np.prod(n)).astype(int)
 
-    # totalsize = np.prod(n) * len(basis)  # unused; removed to satisfy ruff
     mesh = Mesh(dim, L=10000 * np.ones(dim))
 
     slices = tuple([slice(0, ni) for ni in n])
     grid = np.mgrid[slices]
     lattice = np.sum([a[i] * grid[i].ravel()[:, None] for i in range(dim)], axis=0)
-    # print lattice.shape
     if rectangle:
         dx = np.max(np.abs(np.array(a)), axis=0)
         L = dx * np.array(n)
         periodicize(lattice, L)
         mesh.L = L
-    allpts = np.vstack([lattice + b for b in basis])
-    for p in allpts:
-        mesh.add_point(p)
-
-    aidx = np.eye(dim, dtype=int)
-    latticeidx = np.sum(
-        [aidx[i] * grid[i].ravel()[:, None] for i in range(dim)], axis=0
-    )
-    for lpt in latticeidx:
-        for bond, delta in bondlist:
-            secondpt = lpt + delta
-            if not periodic and not rectangle:
-                if np.all((0 <= secondpt) & (secondpt < n)):
-                    mesh.add_bond(idx(lpt, bond[0]), idx(secondpt, bond[1]))
-            else:
-                secondptwrap = np.mod(secondpt, n)
+    mesh.add_points(np.vstack([lattice + b for b in basis]))
+
+    # Bonds of all unit cells at once, ordered by cell and then by bond.
+    latticeidx = grid.reshape(dim, -1).T
+    firsts, seconds, keep = [], [], []
+    for bond, delta in bondlist:
+        secondpt = latticeidx + delta
+        if not periodic and not rectangle:
+            inside = np.all((0 <= secondpt) & (secondpt < n), axis=1)
+            secondptwrap = np.where(inside[:, None], secondpt, 0)
+        else:
+            secondptwrap = np.mod(secondpt, n)
+            if boundaryshift is not None:
                 whichborder = secondptwrap != secondpt
-                if np.any(whichborder) and boundaryshift is not None:
-                    bsd = boundaryshift * np.sign(delta)[:, None]
-                    secondptwrap = secondptwrap + np.sum(bsd[whichborder], axis=0)
-                idx1 = idx(lpt, bond[0])
-                idx2 = idx(np.mod(secondptwrap, n), bond[1])
-                if periodic:
-                    mesh.add_bond(idx1, idx2)
-                else:
-                    dx = np.abs(mesh.Points[idx1] - mesh.Points[idx2])
-                    if np.all(dx < mesh.L / 2):
-                        mesh.add_bond(idx1, idx2)
+                bsd = boundaryshift * np.sign(delta)[:, None]
+                secondptwrap = np.mod(secondptwrap + whichborder @ bsd, n)
+        idx1 = idx(latticeidx, bond[0])
+        idx2 = idx(secondptwrap, bond[1])
+        if periodic:
+            inside = np.ones(len(idx1), dtype=bool)
+        elif rectangle:
+            dx = np.abs(mesh.Points[idx1] - mesh.Points[idx2])
+            inside = np.all(dx < mesh.L / 2, axis=1)
+        firsts.append(idx1)
+        seconds.append(idx2)
+        keep.append(inside)
+    keep = np.stack(keep, axis=1).ravel()
+    mesh.add_bonds(
+        np.stack(firsts, axis=1).ravel()[keep],
+        np.stack(seconds, axis=1).ravel()[keep],
+    )
 
     return mesh
 
@@ -354,9 +503,9 @@ def replacepoints(mesh1, mesh2, x1frac=0.33, x2frac=0.66):
     """
     replace points in mesh1 with points from mesh2 for x between x1 and x2
     """
-    for i, pt in enumerate(mesh1.Points):
-        if x1frac * mesh1.L[0] < pt[0] < x2frac * mesh2.L[0]:
-            mesh1.Points[i] = mesh2.Points[i]
+    x = mesh1.Points[:, 0]
+    inside = (x1frac * mesh1.L[0] < x) & (x < x2frac * mesh2.L[0])
+    mesh1.Points[inside] = mesh2.Points[inside]
     return mesh1
 
 
@@ -373,35 +522,211 @@ def dwallslab(x1, x2, lx=16, ly=6, dwall1=0.25, dwall2=0.75):
 ##################################
 
 
-def rigiditymatrix(mesh):
-    r = []
-    pts = mesh.points()
-    bds = mesh.Bonds
-    dim = len(pts[0])
-    for bd in bds:
-        row = np.zeros(dim * mesh.N)
-        dp = mesh.dr(bd.p2, bd.p1)
-        dp = dp / la.norm(dp)
-        for i in range(dim):
-            row[dim * bd.p1 + i] = dp[i]
-            row[dim * bd.p2 + i] = -dp[i]
-        r.append(row)
-    return np.matrix(r)
+def _bond_directions(mesh):
+    """Unit vectors from the second to the first point of every bond."""
+    bds = mesh.bond_pairs
+    dx = mesh.dr(bds[:, 1], bds[:, 0])
+    return bds, dx / la.norm(dx, axis=1, keepdims=True)
 
 
-def dynamicalmatrix(mesh):
-    r = rigiditymatrix(mesh)
-    return np.dot(r.T, r)
+def rigiditymatrix(mesh, sparse_format=False):
+    """Rigidity matrix relating bond extensions to point displacements.
 
+    :param sparse_format: Return a ``scipy.sparse`` CSR matrix instead of a
+        dense ``np.matrix``.
+    """
+    bds, dp = _bond_directions(mesh)
+    dim = mesh.dim
+    rows = np.repeat(np.arange(len(bds)), 2 * dim)
+    cols = (dim * bds[:, :, None] + np.arange(dim)).reshape(len(bds), -1)
+    data = np.concatenate([dp, -dp], axis=1)
+    r = sparse.csr_matrix(
+        (data.ravel(), (rows, cols.ravel())), shape=(len(bds), dim * mesh.N)
+    )
+    return r if sparse_format else np.matrix(r.toarray())
+
+
+def dynamicalmatrix(mesh, sparse_format=False):
+    r = rigiditymatrix(mesh, sparse_format)
+    return (r.T @ r).tocsc() if sparse_format else np.dot(r.T, r)
 
-def modes(mesh):
-    eigval, eigvec = la.eigh(dynamicalmatrix(mesh))
+
+def modes(mesh, k=None, sigma=-1e-6):
+    """Eigenvalues and eigenvectors of the dynamical matrix, sorted by energy.
+
+    :param k: If given, only compute the ``k`` lowest modes using sparse
+        shift-invert diagonalization.
+    :param sigma: Shift used in the sparse mode. It must lie below the lowest
+        eigenvalue, so that the shifted dynamical matrix is positive definite
+        despite the zero modes.
+    :returns: Array of eigenvalues and array with one eigenvector per row.
+    """
+    if k is None:
+        eigval, eigvec = la.eigh(dynamicalmatrix(mesh))
+    else:
+        d = dynamicalmatrix(mesh, sparse_format=True)
+        eigval, eigvec = sla.eigsh(
+            d, k=k, sigma=sigma, which="LM", v0=np.ones(d.shape[0])
+        )
     eigvec = np.array(eigvec).T
 
     sortedargs = np.argsort(np.real(eigval))
     return np.real(eigval)[sortedargs], np.real(eigvec)[sortedargs]
 
 
+def _match_modes(previous, eigval, eigvec, atol):
+    """Reorder, rotate and flip modes to follow those of the previous frame."""
+    overlaps = previous @ eigvec.T
+    _, order = optimize.linear_sum_assignment(-np.abs(overlaps))
+    eigval, eigvec = eigval[order], eigvec[order]
+
+    # The basis of a degenerate subspace is arbitrary: choose the one closest
+    # to the previous modes (orthogonal Procrustes).
+    bysize = np.argsort(eigval)
+    for group in np.split(bysize, np.nonzero(np.diff(eigval[bysize]) > atol)[0] + 1):
+        if len(group) > 1:
+            u, _, vh = la.svd(previous[group] @ eigvec[group].T)
+            eigvec[group] = u @ vh @ eigvec[group]
+
+    signs = np.sign(np.einsum("ij,ij->i", previous, eigvec))
+    signs[signs == 0] = 1
+    return eigval, eigvec * signs[:, None]
+
+
+def track_modes(meshes, n_modes, sigma=-1e-6, tol=1e-9, maxiter=50, atol=1e-9):
+    """Follow the lowest modes through a sequence of slightly different meshes.
+
+    The first mesh is diagonalized with `modes`. Every following one is
+    solved with LOBPCG, starting from the modes of the previous mesh and
+    preconditioned by the factorized shifted dynamical matrix, so that only a
+    few iterations are needed. The new modes are then matched to the previous
+    ones by overlap, which keeps their order and sign consistent between
+    frames.
+
+    :param meshes: Meshes with the same number of points, for example the
+        frames of an animation.
+    :param n_modes: Number of lowest modes to follow.
+    :param sigma: Shift of the preconditioner, see `modes`.
+    :param tol: Residual tolerance of LOBPCG.
+    :param maxiter: Maximal number of LOBPCG iterations per mesh.
+    :param atol: Eigenvalues closer than this are treated as degenerate.
+    :returns: Array of eigenvalues with shape ``(len(meshes), n_modes)`` and
+        array of eigenvectors with shape ``(len(meshes), n_modes, dim * N)``.
+        Mode ``i`` of every mesh is continuously connected to mode ``i`` of
+        the previous one, so the eigenvalues need not remain sorted.
+    """
+    meshes = list(meshes)
+    eigval, eigvec = modes(meshes[0], k=n_modes, sigma=sigma)
+    eigvals, eigvecs = [eigval], [eigvec]
+    for mesh in meshes[1:]:
+        d = dynamicalmatrix(mesh, sparse_format=True)
+        if d.shape[0] != eigvec.shape[1]:
+            raise ValueError("All meshes must have the same number of points.")
+        lu = sla.splu((d - sigma * sparse.identity(d.shape[0])).tocsc())
+        preconditioner = sla.LinearOperator(d.shape, lu.solve, dtype=float)
+        eigval, vectors = sla.lobpcg(
+            d,
+            eigvec.T.copy(),
+            M=preconditioner,
+            largest=False,
+            tol=tol,
+            maxiter=maxiter,
+        )
+        eigval, eigvec = _match_modes(eigvec, eigval, vectors.T, atol)
+        eigvals.append(eigval)
+        eigvecs.append(eigvec)
+    return np.array(eigvals), np.array(eigvecs)
+
+
+##########################################
+# Periodic lattices in momentum space    #
+##########################################
+
+
+def _klunitcell(x):
+    """Basis points, lattice vectors, bonds and bond cell offsets of the
+    deformed kagome lattice."""
+    points = np.array(klbasispoints(*x))
+    a = np.array(hex2dbasis)
+    pairs = np.array([bond for bond, _ in klbasisbonds])
+    shifts = np.array([delta for _, delta in klbasisbonds]) @ a
+    return points, a, pairs, shifts
+
+
+def blochrigiditymatrix(x, k):
+    """Rigidity matrix of the periodic deformed kagome lattice at wave vectors *k*.
+
+    The Bloch counterpart of `rigiditymatrix` for the lattice made by
+    `kagome2d`: a displacement ``u`` of a basis point in the unit cell at
+    ``R`` is ``u * exp(1j * k @ R)``.
+
+    :param x: Kane-Lubensky parameters ``(x1, x2, x3)`` or ``(x1, x2, x3, z)``.
+    :param k: Array of wave vectors with shape ``(..., 2)``.
+    :returns: Complex array with shape ``(..., 6, 6)``, with one row per bond
+        in `klbasisbonds` and the columns ordered as the x and y
+        displacements of the points returned by `klbasispoints`.
+    """
+    points, a, pairs, shifts = _klunitcell(x)
+    dx = points[pairs[:, 0]] - points[pairs[:, 1]] - shifts
+    dp = dx / la.norm(dx, axis=1, keepdims=True)
+    phases = np.exp(1j * np.asarray(k, dtype=float) @ shifts.T)
+    r = np.zeros(phases.shape + (2 * len(points),), dtype=complex)
+    bonds = np.arange(len(pairs))
+    for d in range(2):
+        r[..., bonds, 2 * pairs[:, 0] + d] += dp[:, d]
+        r[..., bonds, 2 * pairs[:, 1] + d] -= dp[:, d] * phases
+    return r
+
+
+def blochmodes(x, k):
+    """Phonon bands of the periodic deformed kagome lattice.
+
+    All wave vectors are diagonalized at once, so sweeping the
+    parameters only costs a few 6x6 eigenproblems per k-point.
+
+    :param x: Kane-Lubensky parameters, as in `blochrigiditymatrix`.
+    :param k: Array of wave vectors with shape ``(..., 2)``.
+    :returns: Eigenvalues of the dynamical matrix (squared frequencies) with
+        shape ``(..., 6)``, sorted, and eigenvectors with shape
+        ``(..., 6, 6)``, one per row as in `modes`.
+    """
+    r = blochrigiditymatrix(x, k)
+    eigval, eigvec = np.linalg.eigh(r.conj().swapaxes(-1, -2) @ r)
+    return eigval, eigvec.swapaxes(-1, -2)
+
+
+def klpolarization(x, nk=64):
+    """Topological polarization of the deformed kagome lattice.
+
+    Computes the winding numbers ``n_i`` of the phase of the determinant of
+    the Bloch rigidity matrix along closed loops in the direction of the
+    reciprocal lattice vectors. The sign is such that, as in Kane and
+    Lubensky (*Nat Phys 2014*), the flux of ``P_T`` through the boundary of a
+    region, with inward normal, counts its zero modes. The loops pass through
+    the zone boundary to avoid the translational zero modes at ``k = 0``.
+
+    :param x: Kane-Lubensky parameters, as in `blochrigiditymatrix`.
+    :param nk: Number of k-points per loop.
+    :returns: Polarization ``P_T = n_1 a_1 + n_2 a_2``, with ``a_i`` the
+        vectors of `hex2dbasis`.
+    :raises ValueError: If the determinant vanishes on one of the loops, for
+        example at a gap closing, where the winding is not defined.
+    """
+    a = np.array(hex2dbasis)
+    b = 2 * np.pi * la.inv(a).T
+    t = np.arange(nk) / nk
+    # Loop i goes along b_i at half of the other reciprocal vector.
+    ks = np.stack([np.outer(t, b[0]) + b[1] / 2, np.outer(t, b[1]) + b[0] / 2])
+    det = np.linalg.det(blochrigiditymatrix(x, ks))
+    if np.any(np.abs(det) <= 1e-8 * np.abs(det).max()):
+        raise ValueError(
+            f"The polarization is undefined for x={x}: the rigidity matrix has "
+            "a zero mode on the integration loop."
+        )
+    winding = -np.angle(np.roll(det, -1, axis=1) / det).sum(axis=1) / (2 * np.pi)
+    return np.rint(winding) @ a
+
+
 def showlocalizedmode(mesh, modenumber=2):
-    ee, ev = modes(mesh)
+    ee, ev = modes(mesh, k=modenumber + 1)
     return vis2d(mesh, eigenfunction=ev[modenumber], scale=2)
@@ -0,0 +1,291 @@
+"""Scattering computations beyond single calls to `kwant.smatrix`."""
+
+import kwant
+import numpy as np
+from scipy import linalg as la
+from scipy.sparse import csgraph
+
+from .functions import _call_sweep_function, _default_workers, _forked_pool
+
+__all__ = ["smatrix_1d", "smatrix_sweep", "hall_conductivities"]
+
+
+def _lead_blocks(syst, offsets, energy, params):
+    """Eliminate the lead amplitudes from the linear system of `kwant.smatrix`.
+
+    For every lead, returns its interface orbitals and the matrices needed to
+    add its self-energy, build the right hand side and recover the outgoing
+    amplitudes.
+    """
+    leads = []
+    for lead, interface in zip(syst.leads, syst.lead_interfaces):
+        prop, stab = lead.modes(energy, params=params)
+        nprop = stab.nmodes
+        u_in, u_out = stab.vecs[:, :nprop], stab.vecs[:, nprop:]
+        ulinv_in, ulinv_out = stab.vecslmbdainv[:, :nprop], stab.vecslmbdainv[:, nprop:]
+        hop_out = stab.sqrt_hop @ u_out
+        inv_ulinv_out = np.linalg.inv(ulinv_out)
+        leads.append(
+            dict(
+                orbs=np.concatenate(
+                    [np.arange(offsets[i], offsets[i + 1]) for i in interface]
+                ),
+                nprop=nprop,
+                selfenergy=hop_out @ inv_ulinv_out @ stab.sqrt_hop.T.conj(),
+                source=hop_out @ inv_ulinv_out @ ulinv_in - stab.sqrt_hop @ u_in,
+                coupling=inv_ulinv_out @ stab.sqrt_hop.T.conj(),
+                reflection=inv_ulinv_out @ ulinv_in,
+            )
+        )
+    return leads
+
+
+def smatrix_1d(syst, params, energy=0):
+    """Scattering matrices of a quasi-1D system for many parameter sets.
+
+    A fast replacement of ``[kwant.smatrix(syst, energy, params=p).data for p
+    in params]`` for long and narrow systems, such as disordered chains and
+    ribbons. The lead modes are computed once, using ``params[0]``, so the
+    leads must not depend on the parameters that vary, for example because
+    they are precalculated.
+
+    The orbitals are reordered to make the Hamiltonian banded, and the
+    scattering problems for all parameter sets are solved together as one
+    block diagonal banded system, using LU decomposition with partial
+    pivoting.
+
+    Parameters
+    ----------
+    syst : kwant.system.FiniteSystem
+        Finalized system with leads.
+    params : sequence of dicts
+        Parameter sets, for example one per disorder realization.
+    energy : float
+
+    Returns
+    -------
+    smatrices : array of shape (len(params), n_modes, n_modes)
+        Same as the ``data`` attribute of the corresponding `kwant.smatrix`.
+    """
+    params = list(params)
+    hamiltonians = [
+        syst.hamiltonian_submatrix(params=p, sparse=True).tocoo() for p in params
+    ]
+    if not hamiltonians:
+        return np.zeros((0, 0, 0), dtype=complex)
+    norbs = syst.hamiltonian_submatrix(params=params[0], sparse=True, return_norb=True)[
+        1
+    ]
+    offsets = np.concatenate([[0], np.cumsum(norbs)])
+    leads = _lead_blocks(syst, offsets, energy, params[0])
+
+    # Order the orbitals such that H - E - Σ has the smallest bandwidth.
+    size = offsets[-1]
+    pattern = abs(hamiltonians[0]).tolil()
+    for lead in leads:
+        pattern[np.ix_(lead["orbs"], lead["orbs"])] = 1
+    order = csgraph.reverse_cuthill_mckee(pattern.tocsr(), symmetric_mode=True)
+    position = np.empty(size, dtype=int)
+    position[order] = np.arange(size)
+    for lead in leads:
+        lead["orbs"] = position[lead["orbs"]]
+        lead["rows"], lead["cols"] = np.meshgrid(
+            lead["orbs"], lead["orbs"], indexing="ij"
+        )
+    bandwidth = max(
+        [np.abs(position[h.row] - position[h.col]).max(initial=0) for h in hamiltonians]
+        + [np.ptp(lead["orbs"]) for lead in leads]
+    )
+
+    # All systems as one block diagonal matrix in the format of
+    # `scipy.linalg.solve_banded`: element (i, j) is stored at
+    # ``banded[bandwidth + i - j, j]``.
+    num = len(params)
+    banded = np.zeros((2 * bandwidth + 1, num * size), dtype=complex)
+    banded[bandwidth] = -energy
+    for n, h in enumerate(hamiltonians):
+        rows, cols = position[h.row], position[h.col]
+        np.add.at(banded, (bandwidth + rows - cols, n * size + cols), h.data)
+        for lead in leads:
+            banded[
+                bandwidth + lead["rows"] - lead["cols"], n * size + lead["cols"]
+            ] += lead["selfenergy"]
+
+    # Incoming modes of all leads, in the same order as the columns of the
+    # scattering matrix.
+    nprops = [lead["nprop"] for lead in leads]
+    starts = np.concatenate([[0], np.cumsum(nprops)])
+    sources = np.zeros((num, size, starts[-1]), dtype=complex)
+    for lead, start, stop in zip(leads, starts, starts[1:]):
+        sources[:, lead["orbs"], start:stop] = lead["source"]
+    psi = la.solve_banded(
+        (bandwidth, bandwidth),
+        banded,
+        sources.reshape(num * size, -1),
+        check_finite=False,
+    ).reshape(num, size, -1)
+
+    blocks = []
+    for lead, start, stop in zip(leads, starts, starts[1:]):
+        amplitudes = lead["coupling"] @ psi[:, lead["orbs"]]
+        amplitudes[..., start:stop] -= lead["reflection"]
+        blocks.append(amplitudes[:, : lead["nprop"]])
+    return np.concatenate(blocks, axis=1)
+
+
+def _lead_key(syst, params):
+    """Hashable values of the parameters that the leads depend on.
+
+    Returns ``None`` if some of these values are not hashable.
+    """
+    names = sorted(frozenset().union(*(lead.parameters for lead in syst.leads)))
+    key = tuple((name, params.get(name)) for name in names)
+    try:
+        hash(key)
+    except TypeError:
+        return None
+    return key
+
+
+def smatrix_sweep(
+    syst, param_grid, energy=0, *, output="data", leads=None, workers=None
+):
+    """Scattering matrices of a system over a grid of parameter sets.
+
+    A faster replacement of ``[kwant.smatrix(syst, energy, params=p) for p in
+    param_grid]``. The lead modes are computed only once for every distinct
+    set of values of the parameters that the leads depend on, instead of
+    once per point, and the points are split over forked worker processes.
+
+    Parameters
+    ----------
+    syst : kwant.system.FiniteSystem
+        Finalized system with leads.
+    param_grid : sequence of dicts
+        Parameter sets to evaluate the scattering matrix at. Use separate
+        dicts, not one dict modified in place.
+    energy : float
+    output : {"data", "transmission", "submatrix", "conductance_matrix"}
+        Which result to return for every parameter set: the whole scattering
+        matrix, or the corresponding method of `kwant.solvers.common.SMatrix`
+        (applied to ``leads``).
+    leads : pair of lead indices, optional
+        Outgoing and incoming lead, required for ``"transmission"`` and
+        ``"submatrix"``.
+    workers : int, optional
+        Number of worker processes, defaults to ``COURSE_WORKERS`` or else the
+        number of available CPUs.
+
+    Returns
+    -------
+    results : array
+        The results for all parameter sets stacked along the first axis. With
+        ``output="data"`` or ``"submatrix"``, the number of modes in the leads
+        must therefore be the same at every point.
+    """
+    if output not in ("data", "transmission", "submatrix", "conductance_matrix"):
+        raise ValueError(f"Unknown output {output!r}.")
+    if output in ("transmission", "submatrix") and leads is None:
+        raise ValueError(f"output={output!r} requires the leads.")
+    param_grid = list(param_grid)
+    if workers is None:
+        workers = _default_workers()
+
+    # Points sharing the lead parameters form one group, split into at most
+    # one chunk per worker.
+    groups = {}
+    for i, params in enumerate(param_grid):
+        key = _lead_key(syst, params)
+        groups.setdefault(i if key is None else key, []).append(i)
+    chunks = [
+        (key, chunk)
+        for key, group in groups.items()
+        for chunk in np.array_split(group, min(workers, len(group)))
+    ]
+
+    precalculated = {}
+
+    def evaluate(chunk):
+        key, indices = chunk
+        if key not in precalculated:
+            precalculated[key] = syst.precalculate(
+                energy, params=param_grid[indices[0]]
+            )
+        results = []
+        for i in indices:
+            smatrix = kwant.smatrix(precalculated[key], energy, params=param_grid[i])
+            results.append(
+                smatrix.data
+                if output == "data"
+                else getattr(smatrix, output)(*(leads or ()))
+            )
+        return results
+
+    results = [None] * len(param_grid)
+    with _forked_pool(evaluate, min(workers, len(chunks))) as executor:
+        if executor is None:
+            values = map(evaluate, chunks)
+        else:
+            values = executor.map(_call_sweep_function, chunks)
+        for (_, indices), chunk_results in zip(chunks, values):
+            for i, result in zip(indices, chunk_results):
+                results[i] = result
+    return np.array(results)
+
+
+def hall_conductivities(
+    syst,
+    param_grid,
+    energy=0,
+    *,
+    source,
+    drain,
+    longitudinal,
+    transverse,
+    workers=None,
+):
+    """Longitudinal and Hall conductivities of a Hall bar over a parameter grid.
+
+    A unit current flows from lead ``source`` to the grounded lead ``drain``,
+    while all other leads are voltage probes without net current. The
+    conductance matrices are computed with `smatrix_sweep`, and the lead
+    voltages at all points are obtained from a single stacked linear solve.
+
+    Parameters
+    ----------
+    syst : kwant.system.FiniteSystem
+        Finalized multi-terminal system.
+    param_grid : sequence of dicts
+        Parameter sets, see `smatrix_sweep`.
+    energy : float
+    source, drain : int
+        Leads where the current enters and leaves.
+    longitudinal, transverse : pair of ints
+        Leads ``(a, b)`` whose voltage difference ``V_a - V_b`` gives the
+        longitudinal and transverse electric field.
+    workers : int, optional
+        Number of worker processes, defaults to ``COURSE_WORKERS`` or else the
+        number of available CPUs.
+
+    Returns
+    -------
+    sigma_xx, sigma_xy : arrays
+        Conductivities in units of the conductance quantum, one per parameter
+        set.
+    """
+    conductances = smatrix_sweep(
+        syst, param_grid, energy, output="conductance_matrix", workers=workers
+    )
+    num, nleads = conductances.shape[:2]
+    probes = np.delete(np.arange(nleads), drain)
+    currents = np.zeros((num, len(probes), 1))
+    currents[:, probes == source] = 1
+    voltages = np.zeros((num, nleads))
+    voltages[:, probes] = np.linalg.solve(
+        conductances[:, probes[:, None], probes], currents
+    )[..., 0]
+
+    field_x = voltages[:, longitudinal[0]] - voltages[:, longitudinal[1]]
+    field_y = voltages[:, transverse[0]] - voltages[:, transverse[1]]
+    field_squared = field_x**2 + field_y**2
+    return field_x / field_squared, field_y / field_squared
@@ -0,0 +1,62 @@
+#!/usr/bin/env python3
+"""
+Check the cold start budget of ``course.init_course``.
+
+In a fresh interpreter with an IPython shell and NumPy, which every notebook
+imports anyway, runs ``from course.init_course import init_notebook;
+init_notebook()`` and fails if this imports one of the packages that are
+supposed to be deferred, or takes longer than the budget.
+"""
+
+from __future__ import annotations
+
+import argparse
+import ast
+import subprocess
+import sys
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+DEFERRED = ("kwant", "plotly", "matplotlib", "course.functions")
+
+MEASURE = f"""
+import sys, time
+import numpy
+from IPython.core.interactiveshell import InteractiveShell
+InteractiveShell.instance()
+start = time.perf_counter()
+from course.init_course import init_notebook
+init_notebook()
+elapsed = time.perf_counter() - start
+print([name for name in {DEFERRED!r} if name in sys.modules])
+print(elapsed)
+"""
+
+
+def measure() -> tuple[list[str], float]:
+    """Deferred packages that were imported anyway, and the time taken."""
+    result = subprocess.run(
+        [sys.executable, "-c", MEASURE],
+        cwd=ROOT,
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    *_, imported, elapsed = result.stdout.strip().splitlines()
+    return ast.literal_eval(imported), float(elapsed)
+
+
+def main(budget: float) -> int:
+    imported, elapsed = measure()
+    print(f"init_notebook cold start: {elapsed:.3f} s (budget {budget} s)")
+    if imported:
+        print(f"Imported eagerly: {', '.join(imported)}")
+    return 1 if imported or elapsed > budget else 0
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.strip().split("\n\n")[0])
+    parser.add_argument(
+        "--budget", type=float, default=0.1, help="maximal time in seconds"
+    )
+    sys.exit(main(parser.parse_args().budget))
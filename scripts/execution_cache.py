@@ -0,0 +1,586 @@
+#!/usr/bin/env python3
+"""
+Invalidate the Jupyter Book execution cache only for notebooks whose inputs
+changed.
+
+The execution cache of Jupyter Book (mystmd) is keyed on the code of a
+notebook alone, so it goes stale when the ``course`` package or a dataset in
+``data/`` changes. Instead of clearing the whole cache, this script records
+which ``course`` objects and datasets every notebook uses, together with a
+fingerprint of their source, in ``_build/execution_dependencies.json``. On the
+next run, the cached outputs of the notebooks with a changed dependency are
+removed, so only those are executed again.
+
+A ``course`` object depends on the other ``course`` objects it refers to, on
+data files in ``course/`` (such as ``matplotlibrc``) that it names, and on the
+statements that its module runs on import besides definitions, such as
+``if`` and ``try`` blocks. Naming a module of ``course``, such as
+``"functions.py"``, is a dependency on the names that it exports. Source is
+compared after parsing, so comments and formatting do not matter. Notebooks
+whose code cannot be parsed depend on the whole package.
+
+The cache keys are computed the way mystmd does, which is not a public
+interface. If a notebook has changed dependencies, but none of its cached
+outputs are found, the whole execution cache is cleared instead.
+
+With ``--check``, every ``course`` object is edited in turn, and the script
+fails if that would execute a notebook again that does not name the object,
+nor anything that refers to it by name.
+"""
+
+from __future__ import annotations
+
+import argparse
+import ast
+import functools
+import hashlib
+import json
+import re
+import shutil
+import sys
+from collections import defaultdict
+from dataclasses import dataclass, field
+from pathlib import Path
+
+import yaml
+from postprocess_html import ROOT, load_markdown_sources
+
+COURSE = ROOT / "course"
+DATA = ROOT / "data"
+EXECUTE_CACHE = ROOT / "_build" / "execute"
+MANIFEST = ROOT / "_build" / "execution_dependencies.json"
+CACHE_SUFFIXES = (".ipynb", ".json")
+
+FRONTMATTER_RE = re.compile(r"\A---\n(.*?)\n---\n", re.S)
+CELL_RE = re.compile(r"^```\{code-cell\}[^\n]*\n(.*?)^```[ \t]*$", re.M | re.S)
+EVAL_RE = re.compile(r"\{eval\}`([^`]*)`")
+OPTION_RE = re.compile(r"^:([\w-]+):(.*)$")
+
+
+@dataclass
+class Notebook:
+    path: Path
+    cache_key: str | None
+    symbols: set[tuple[str, str]] = field(default_factory=set)
+    datasets: set[str] = field(default_factory=set)
+    names: set[str] = field(default_factory=set)
+
+
+# Parsing of notebooks
+
+
+def _cell_options(body: str) -> tuple[dict, str]:
+    """Split the body of a code cell into its options and its code."""
+    lines = body.split("\n")
+    options = {}
+    if lines[0].strip() == "---":
+        end = lines.index("---", 1)
+        options = yaml.safe_load("\n".join(lines[1:end])) or {}
+        lines = lines[end + 1 :]
+    else:
+        while lines and (match := OPTION_RE.match(lines[0])):
+            options[match[1]] = yaml.safe_load(match[2])
+            lines = lines[1:]
+    while lines and not lines[0].strip():
+        lines = lines[1:]
+    while lines and not lines[-1].strip():
+        lines = lines[:-1]
+    return options, "\n".join(lines)
+
+
+def cache_key(kernel_name: str, nodes: list[dict]) -> str:
+    """Key of the Jupyter Book execution cache, as computed by myst-execute."""
+    items = json.dumps(nodes, separators=(",", ":"), ensure_ascii=False)
+    return hashlib.md5((kernel_name + items).encode()).hexdigest()
+
+
+def _course_imports(tree: ast.AST) -> set[tuple[str, str]]:
+    """Objects imported from ``course``, ``"*"`` standing for a whole module."""
+    symbols, modules = set(), {}
+    for node in ast.walk(tree):
+        if isinstance(node, ast.ImportFrom) and node.module:
+            if node.module == "course":
+                for alias in node.names:
+                    if alias.name == "cache":
+                        symbols.add(("caching", "cache"))
+                    else:
+                        modules[alias.asname or alias.name] = alias.name
+            elif node.module.startswith("course."):
+                module = node.module.split(".")[1]
+                symbols.update((module, alias.name) for alias in node.names)
+        elif isinstance(node, ast.Import):
+            for alias in node.names:
+                parts = alias.name.split(".")
+                if parts[0] != "course":
+                    continue
+                if alias.asname and len(parts) > 1:
+                    modules[alias.asname] = parts[1]
+                else:
+                    symbols.add((parts[1] if len(parts) > 1 else "*", "*"))
+    # A module that is only used for its attributes depends on those alone.
+    attribute_of_module, whole = set(), set(modules)
+    for node in ast.walk(tree):
+        if isinstance(node, ast.Attribute) and isinstance(node.value, ast.Name):
+            if node.value.id in modules:
+                symbols.add((modules[node.value.id], node.attr))
+                attribute_of_module.add(node.value)
+                whole.discard(node.value.id)
+    for node in ast.walk(tree):
+        if (
+            isinstance(node, ast.Name)
+            and node.id in modules
+            and node not in attribute_of_module
+        ):
+            whole.add(node.id)
+    symbols.update((modules[name], "*") for name in whole)
+    return symbols
+
+
+def _identifiers(tree: ast.AST) -> set[str]:
+    """Names and attributes used in ``tree``, and names that it imports."""
+    names = set()
+    for node in ast.walk(tree):
+        if isinstance(node, ast.Name):
+            names.add(node.id)
+        elif isinstance(node, ast.Attribute):
+            names.add(node.attr)
+        elif isinstance(node, ast.alias):
+            names.add(node.name.split(".")[-1])
+    return names
+
+
+def parse_notebook(path: Path, dataset_names: set[str]) -> Notebook:
+    text = (ROOT / path).read_text(encoding="utf-8")
+    frontmatter = {}
+    if match := FRONTMATTER_RE.match(text):
+        frontmatter = yaml.safe_load(match[1]) or {}
+    kernel_name = (frontmatter.get("kernelspec") or {}).get("name")
+
+    nodes, code = [], []
+    position = 0
+    for cell in CELL_RE.finditer(text):
+        for expression in EVAL_RE.findall(text, position, cell.start()):
+            nodes.append(
+                {
+                    "kind": "inlineExpression",
+                    "content": expression,
+                    "raisesException": False,
+                }
+            )
+        position = cell.end()
+        options, source = _cell_options(cell[1])
+        tags = options.get("tags") or []
+        if "skip-execution" in tags:
+            continue
+        nodes.append(
+            {
+                "kind": "block",
+                "content": source,
+                "raisesException": "raises-exception" in tags,
+            }
+        )
+        code.append(source)
+    for expression in EVAL_RE.findall(text, position):
+        nodes.append(
+            {
+                "kind": "inlineExpression",
+                "content": expression,
+                "raisesException": False,
+            }
+        )
+    code.extend(node["content"] for node in nodes if node["kind"] == "inlineExpression")
+
+    skip = (frontmatter.get("execute") or {}).get("skip")
+    if not nodes or kernel_name is None or skip:
+        return Notebook(path, None)
+    notebook = Notebook(path, cache_key(kernel_name, nodes))
+
+    # IPython magics and shell commands are not Python.
+    source = "\n".join(
+        line
+        for line in "\n".join(code).split("\n")
+        if not line.lstrip().startswith(("%", "!"))
+    )
+    try:
+        tree = ast.parse(source)
+    except SyntaxError:
+        notebook.symbols = {("*", "*")}
+        notebook.datasets = set(dataset_names)
+        return notebook
+    notebook.symbols = _course_imports(tree)
+    notebook.names = _identifiers(tree)
+    for node in ast.walk(tree):
+        if isinstance(node, ast.Constant) and isinstance(node.value, str):
+            name = node.value.rstrip("/").rpartition("/")[2]
+            if name in dataset_names:
+                notebook.datasets.add(name)
+    return notebook
+
+
+# Fingerprints of the course package
+
+
+_dump = functools.cache(ast.dump)
+
+
+def _binds_names(node: ast.AST) -> bool:
+    """Whether a statement only assigns values to names."""
+    if isinstance(node, ast.Assign):
+        targets = node.targets
+    elif isinstance(node, (ast.AnnAssign, ast.AugAssign)):
+        targets = [node.target]
+    else:
+        return False
+    return all(
+        isinstance(child, (ast.Name, ast.Tuple, ast.List, ast.Starred, ast.Store))
+        for target in targets
+        for child in ast.walk(target)
+    )
+
+
+class CourseIndex:
+    """Top-level definitions of the ``course`` modules and what they refer to."""
+
+    def __init__(self, package: Path = COURSE):
+        self.package = package
+        self.modules = sorted(path.stem for path in package.glob("*.py"))
+        self.files = {path.name for path in package.iterdir() if path.is_file()}
+        self.definitions: dict[str, dict[str, list[ast.AST]]] = {}
+        self.aliases: dict[str, dict[str, tuple[str, str]]] = {}
+        self.statements: dict[str, list[ast.AST]] = {}
+        for module in self.modules:
+            self._index(module)
+
+    def _sibling(self, node: ast.ImportFrom) -> str | None:
+        """Module of ``course`` imported from, "" for the package itself."""
+        if node.level == 1:
+            return node.module or ""
+        if node.module == "course":
+            return ""
+        if node.module and node.module.startswith("course."):
+            return node.module.split(".")[1]
+        return None
+
+    def _import_aliases(self, nodes) -> dict[str, tuple[str, str]]:
+        aliases = {}
+        for node in nodes:
+            if not isinstance(node, ast.ImportFrom):
+                continue
+            module = self._sibling(node)
+            if module is None:
+                continue
+            for alias in node.names:
+                if module != "":
+                    target = (module, alias.name)
+                elif alias.name in self.modules:
+                    target = (alias.name, "*")
+                else:
+                    target = ("__init__", alias.name)
+                aliases[alias.asname or alias.name] = target
+        return aliases
+
+    def _index(self, module: str) -> None:
+        tree = ast.parse((self.package / f"{module}.py").read_text(encoding="utf-8"))
+        definitions, statements = defaultdict(list), []
+        for node in tree.body:
+            if isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef, ast.ClassDef)):
+                definitions[node.name].append(node)
+                continue
+            if isinstance(node, (ast.Import, ast.ImportFrom)) or (
+                node is tree.body[0] and ast.get_docstring(tree) is not None
+            ):
+                continue
+            stored = [
+                child
+                for child in ast.walk(node)
+                if isinstance(child, ast.Name) and isinstance(child.ctx, ast.Store)
+            ]
+            for child in stored:
+                definitions[child.id].append(node)
+            # Anything else than binding names runs whenever the module is used.
+            if not _binds_names(node):
+                statements.append(node)
+        self.definitions[module] = definitions
+        self.statements[module] = statements
+        self.aliases[module] = self._import_aliases(tree.body)
+
+    @functools.cache
+    def _references(self, module: str, node: ast.AST):
+        """Course objects and files that a definition refers to."""
+        aliases = {**self.aliases[module], **self._import_aliases(ast.walk(node))}
+        symbols, files = set(), set()
+        attribute_of_module = set()
+        for child in ast.walk(node):
+            if isinstance(child, ast.Attribute) and isinstance(child.value, ast.Name):
+                target = aliases.get(child.value.id)
+                if target is not None and target[1] == "*":
+                    # Only the attribute is used, not the whole module.
+                    symbols.add((target[0], child.attr))
+                    attribute_of_module.add(child.value)
+            elif isinstance(child, ast.Name) and child not in attribute_of_module:
+                if child.id in aliases:
+                    symbols.add(aliases[child.id])
+                elif child.id in self.definitions[module]:
+                    symbols.add((module, child.id))
+            elif isinstance(child, ast.Constant) and child.value in self.files:
+                # A module is read for what it defines, not for its bytes.
+                stem = child.value.removesuffix(".py")
+                if child.value.endswith(".py") and stem in self.modules:
+                    exports = self.exports(stem)
+                    if exports is None:
+                        symbols.add((stem, "*"))
+                    else:
+                        symbols.update((stem, name) for name in exports)
+                else:
+                    files.add(child.value)
+        return symbols, files
+
+    def exports(self, module: str) -> list[str] | None:
+        """``__all__`` of ``module``, if it can be found without running it."""
+        name, seen = "__all__", set()
+        while (module, name) not in seen:
+            seen.add((module, name))
+            values = [
+                node.value
+                for node in self.definitions.get(module, {}).get(name, [])
+                if isinstance(node, ast.Assign)
+                and [getattr(target, "id", None) for target in node.targets] == [name]
+            ]
+            if len(values) != 1:
+                return None
+            value = values[0]
+            # Follow ``list(name)`` and ``name`` to the literal.
+            if (
+                isinstance(value, ast.Call)
+                and getattr(value.func, "id", None) in ("list", "tuple")
+                and len(value.args) == 1
+                and not value.keywords
+            ):
+                value = value.args[0]
+            if isinstance(value, ast.Name):
+                module, name = self.aliases[module].get(value.id, (module, value.id))
+                continue
+            try:
+                return list(ast.literal_eval(value))
+            except ValueError:
+                return None
+        return None
+
+    def read(self, name: str) -> bytes:
+        return (self.package / name).read_bytes()
+
+    def fingerprint(self, symbol: tuple[str, str]) -> str:
+        """Hash of the source of ``symbol`` and everything it depends on."""
+        digest = hashlib.sha256()
+        seen, modules, files = set(), set(), set()
+        stack = [symbol]
+        while stack:
+            module, name = stack.pop()
+            if (module, name) in seen:
+                continue
+            seen.add((module, name))
+            if module == "*":
+                stack.extend((m, "*") for m in self.modules)
+                continue
+            if module not in self.definitions:
+                continue
+            if module not in modules:
+                modules.add(module)
+                for node in self.statements[module]:
+                    symbols, names = self._references(module, node)
+                    stack.extend(symbols)
+                    files.update(names)
+            if name == "*":
+                stack.extend((module, n) for n in self.definitions[module])
+            elif name in self.definitions[module]:
+                for node in self.definitions[module][name]:
+                    symbols, names = self._references(module, node)
+                    stack.extend(symbols)
+                    files.update(names)
+            elif name in self.aliases[module]:
+                stack.append(self.aliases[module][name])
+            else:
+                # Provided dynamically, for example by a module __getattr__.
+                stack.append((module, "*"))
+        for module in sorted(modules):
+            for node in self.statements[module]:
+                digest.update(f"{module}:{_dump(node)};".encode())
+        for module, name in sorted(seen):
+            for node in self.definitions.get(module, {}).get(name, []):
+                digest.update(f"{module}.{name}:{_dump(node)};".encode())
+        for name in sorted(files):
+            digest.update(name.encode() + self.read(name))
+        return digest.hexdigest()
+
+
+def dataset_fingerprint(name: str) -> str:
+    digest = hashlib.sha256()
+    for path in sorted((DATA / name).rglob("*")):
+        if path.is_file():
+            digest.update(path.relative_to(DATA).as_posix().encode())
+            digest.update(path.read_bytes())
+    return digest.hexdigest()
+
+
+# Invalidation
+
+
+def cached_outputs() -> list[Path]:
+    if not EXECUTE_CACHE.is_dir():
+        return []
+    return [path for path in EXECUTE_CACHE.iterdir() if path.suffix in CACHE_SUFFIXES]
+
+
+def remove_cached_outputs(key: str) -> bool:
+    removed = False
+    for suffix in CACHE_SUFFIXES:
+        path = EXECUTE_CACHE / f"{key}{suffix}"
+        if path.exists():
+            path.unlink()
+            removed = True
+    return removed
+
+
+def executed_notebooks() -> list[Notebook]:
+    dataset_names = {path.name for path in DATA.iterdir() if path.is_dir()}
+    notebooks = [
+        parse_notebook(path, dataset_names) for path in load_markdown_sources()
+    ]
+    return [notebook for notebook in notebooks if notebook.cache_key is not None]
+
+
+def course_dependencies(index: CourseIndex, notebook: Notebook) -> dict[str, str]:
+    return {
+        f"{module}.{name}": index.fingerprint((module, name))
+        for module, name in sorted(notebook.symbols)
+    }
+
+
+def update_execution_cache(dry_run: bool = False) -> None:
+    index = CourseIndex()
+    previous = {}
+    if MANIFEST.exists():
+        previous = json.loads(MANIFEST.read_text(encoding="utf-8"))
+
+    manifest, invalidated, unmatched = {}, [], []
+    for notebook in executed_notebooks():
+        path = notebook.path
+        dependencies = course_dependencies(index, notebook)
+        dependencies.update(
+            (f"data/{name}", dataset_fingerprint(name))
+            for name in sorted(notebook.datasets)
+        )
+        record = {"cache_key": notebook.cache_key, "dependencies": dependencies}
+        manifest[path.as_posix()] = record
+
+        old = previous.get(path.as_posix())
+        if old == record:
+            continue
+        if old is None:
+            reason = "no dependency record"
+        elif old["cache_key"] != notebook.cache_key:
+            reason = "code changed"
+        else:
+            changed = {
+                name
+                for name in {*dependencies, *old["dependencies"]}
+                if dependencies.get(name) != old["dependencies"].get(name)
+            }
+            reason = "changed " + ", ".join(sorted(changed))
+        print(f"{path}: {reason}")
+        if not dry_run:
+            # Outputs stored under the previous key are never used again.
+            keys = {notebook.cache_key, (old or {}).get("cache_key")} - {None}
+            if any([remove_cached_outputs(key) for key in keys]):
+                invalidated.append(path)
+            elif old is not None and old["cache_key"] == notebook.cache_key:
+                unmatched.append(path)
+
+    if unmatched and cached_outputs():
+        # The outputs were cached under a key that we cannot reproduce, most
+        # likely because mystmd changed how it computes them.
+        print(
+            "No cached outputs found for "
+            + ", ".join(str(path) for path in unmatched)
+            + f"; clearing the whole execution cache in {EXECUTE_CACHE}."
+        )
+        shutil.rmtree(EXECUTE_CACHE)
+        invalidated = list(manifest)
+
+    if not dry_run:
+        MANIFEST.parent.mkdir(parents=True, exist_ok=True)
+        MANIFEST.write_text(
+            json.dumps(manifest, indent=2, sort_keys=True) + "\n", encoding="utf-8"
+        )
+    print(f"Removed cached outputs of {len(invalidated)} of {len(manifest)} notebooks.")
+
+
+def _names_used(index: CourseIndex, names: set[str]) -> set[str]:
+    """``names`` and, recursively, the names in course definitions of them."""
+    used = set(names)
+    for module in index.modules:
+        for node in index.statements[module]:
+            used |= _identifiers(node)
+    stack = list(used)
+    while stack:
+        name = stack.pop()
+        for module in index.modules:
+            for node in index.definitions[module].get(name, []):
+                new = _identifiers(node) - used
+                used |= new
+                stack.extend(new)
+    return used
+
+
+def check_unused_edits() -> int:
+    """Edit every ``course`` object and report notebooks that do not use it,
+    but would be executed again."""
+    index = CourseIndex()
+    notebooks = [
+        notebook
+        for notebook in executed_notebooks()
+        if not any(name == "*" for _, name in notebook.symbols)
+    ]
+    before = [course_dependencies(index, notebook) for notebook in notebooks]
+    used = [_names_used(index, notebook.names) for notebook in notebooks]
+
+    failures = 0
+    for module in index.modules:
+        for name, definitions in index.definitions[module].items():
+            unused_by = [
+                (notebook, old)
+                for notebook, old, names in zip(notebooks, before, used)
+                if name not in names
+            ]
+            if name.startswith("__") or not unused_by:
+                continue
+            # Any change of the source changes its dump and the file.
+            definitions.append(ast.Pass())
+            index.read = lambda name, edited=f"{module}.py": (
+                CourseIndex.read(index, name) + b"\n" * (name == edited)
+            )
+            for notebook, old in unused_by:
+                if course_dependencies(index, notebook) != old:
+                    print(f"Editing {module}.{name} invalidates {notebook.path}")
+                    failures += 1
+            definitions.pop()
+            del index.read
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.strip().split("\n\n")[0])
+    parser.add_argument(
+        "--dry-run",
+        action="store_true",
+        help="only report which notebooks would be executed again",
+    )
+    parser.add_argument(
+        "--check",
+        action="store_true",
+        help="check that editing unused course code invalidates no notebook",
+    )
+    args = parser.parse_args()
+    if args.check:
+        sys.exit(check_unused_edits())
+    update_execution_cache(args.dry_run)
@@ -3,15 +3,27 @@
 Copy site-wide static assets into the built HTML tree, inject quiz/analytics
 snippets, and generate legacy HTML redirects so older URLs continue to work.
 The script is idempotent and safe to run repeatedly.
+
+File I/O runs in a thread pool. Pages whose modification time and hash match
+the manifest of the previous run are skipped, and static assets are only copied
+when they differ from the copy in the build, so rerunning on an unchanged site
+costs almost nothing.
 """
 
 from __future__ import annotations
 
+import hashlib
+import json
+import os
 import shutil
+import tempfile
+import time
 from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
 from dataclasses import dataclass
 from pathlib import Path
-from typing import Iterable, Sequence
+from typing import Iterable, Iterator, Sequence
 
 import yaml
 
@@ -20,6 +32,11 @@ MYST_CONFIG = ROOT / "myst.yml"
 STATIC_SRC = ROOT / "_static"
 BUILD_HTML = ROOT / "_build" / "html"
 BUILD_TARGETS = [BUILD_HTML]
+MANIFEST = ROOT / "_build" / "postprocess_manifest.json"
+MAX_WORKERS = min(32, (os.cpu_count() or 1) + 4)
+# Bytes at the end of a page searched for </body> and the injected snippets.
+TAIL_SIZE = 64 * 1024
+COPY_BLOCK = 1 << 20
 
 QUIZ_SNIPPET = '<script src="/_static/quiz.js" defer></script>'
 ANALYTICS_SNIPPET = '<script src="/_static/matomo.js" defer></script>'
@@ -99,77 +116,222 @@ def build_redirect_specs() -> list[RedirectSpec]:
     return specs
 
 
-def write_redirects(target: Path, redirects: Sequence[RedirectSpec]) -> int:
-    created = 0
-    for spec in redirects:
-        destination = target / spec.legacy_html
-        destination.parent.mkdir(parents=True, exist_ok=True)
-        target_href = spec.canonical_url
-        html = HTML_REDIRECT_TEMPLATE.format(
-            target_href=target_href,
-            canonical_url=spec.canonical_url,
-        )
-        if destination.exists() and destination.read_text(encoding="utf-8") == html:
-            continue
-        destination.write_text(html, encoding="utf-8")
-        created += 1
-    return created
+def write_redirect(target: Path, spec: RedirectSpec) -> bool:
+    destination = target / spec.legacy_html
+    destination.parent.mkdir(parents=True, exist_ok=True)
+    target_href = spec.canonical_url
+    html = HTML_REDIRECT_TEMPLATE.format(
+        target_href=target_href,
+        canonical_url=spec.canonical_url,
+    )
+    if destination.exists() and destination.read_text(encoding="utf-8") == html:
+        return False
+    destination.write_text(html, encoding="utf-8")
+    return True
+
+
+def write_redirects(
+    target: Path, redirects: Sequence[RedirectSpec], executor: ThreadPoolExecutor
+) -> int:
+    return sum(executor.map(lambda spec: write_redirect(target, spec), redirects))
+
 
+def copy_if_changed(src_file: Path, dst_file: Path) -> bool:
+    # copy2 preserves the modification time, so equal size and mtime mean that
+    # the file was copied before and did not change since.
+    src_stat = src_file.stat()
+    try:
+        dst_stat = dst_file.stat()
+    except FileNotFoundError:
+        pass
+    else:
+        if (dst_stat.st_size, dst_stat.st_mtime_ns) == (
+            src_stat.st_size,
+            src_stat.st_mtime_ns,
+        ):
+            return False
+    dst_file.parent.mkdir(parents=True, exist_ok=True)
+    shutil.copy2(src_file, dst_file)
+    return True
 
-def copy_static(dest: Path) -> None:
+
+def copy_static(dest: Path, executor: ThreadPoolExecutor) -> int:
     if not STATIC_SRC.exists():
         raise FileNotFoundError(f"Static source directory missing: {STATIC_SRC}")
-    for src_file in STATIC_SRC.rglob("*"):
-        if not src_file.is_file():
-            continue
-        rel = src_file.relative_to(STATIC_SRC)
-        dst_file = dest / rel
-        dst_file.parent.mkdir(parents=True, exist_ok=True)
-        shutil.copy2(src_file, dst_file)
+    files = [path for path in STATIC_SRC.rglob("*") if path.is_file()]
+    return sum(
+        executor.map(
+            lambda src_file: copy_if_changed(
+                src_file, dest / src_file.relative_to(STATIC_SRC)
+            ),
+            files,
+        )
+    )
+
+
+def _rfind_in_file(f, needles: list[bytes]) -> dict[bytes, int]:
+    """Offsets of the last occurrence of each of ``needles`` in ``f``, or -1."""
+    overlap = max(map(len, needles)) - 1
+    found = dict.fromkeys(needles, -1)
+    f.seek(0)
+    offset, previous = 0, b""
+    for block in iter(lambda: f.read(COPY_BLOCK), b""):
+        # Keep the end of the previous block for matches across blocks.
+        window = previous + block
+        start = offset - len(previous)
+        for needle in needles:
+            position = window.rfind(needle)
+            if position >= 0:
+                found[needle] = start + position
+        offset += len(block)
+        previous = window[-overlap:] if overlap else b""
+    return found
 
 
 def inject_scripts(page: Path) -> bool:
-    html = page.read_text(encoding="utf-8")
-
-    snippets = []
-    if QUIZ_SNIPPET not in html:
-        snippets.append(QUIZ_SNIPPET)
-    if ANALYTICS_SNIPPET not in html:
-        snippets.append(ANALYTICS_SNIPPET)
-
+    """Add the snippets missing before ``</body>``, streaming the page.
+
+    The last `TAIL_SIZE` bytes are searched for ``</body>`` and for the
+    snippets, which this function places there; only if ``</body>`` is not
+    found there the whole page is scanned. The updated page is written to a
+    temporary file that replaces the original, so even pages with large
+    inlined figures are never held in memory.
+    """
+    size = page.stat().st_size
+    snippets = [snippet.encode() for snippet in (QUIZ_SNIPPET, ANALYTICS_SNIPPET)]
+    # Snippets injected earlier end right before </body>.
+    margin = sum(len(snippet) + 1 for snippet in snippets)
+    with open(page, "rb") as f:
+        tail_start = max(0, size - TAIL_SIZE - margin)
+        f.seek(tail_start)
+        tail = f.read()
+        body_end = tail.rfind(b"</body>")
+        if body_end >= margin or (body_end >= 0 and tail_start == 0):
+            split = tail_start + body_end
+            present = {snippet for snippet in snippets if snippet in tail}
+        else:
+            found = _rfind_in_file(f, [b"</body>", *snippets])
+            split = found.pop(b"</body>")
+            present = {snippet for snippet, at in found.items() if at >= 0}
+
+    snippets = [snippet for snippet in snippets if snippet not in present]
     if not snippets:
         return False
 
-    injection = "\n".join(snippets) + "\n"
-    if "</body>" in html:
-        updated = html.replace("</body>", f"{injection}</body>", 1)
-    else:
-        updated = html + "\n" + injection
-    page.write_text(updated, encoding="utf-8")
+    injection = b"\n".join(snippets) + b"\n"
+    if split < 0:
+        split, injection = size, b"\n" + injection
+
+    fd, tmp_name = tempfile.mkstemp(dir=page.parent, prefix=".", suffix=".tmp")
+    try:
+        with open(page, "rb") as src, os.fdopen(fd, "wb") as dst:
+            remaining = split
+            while remaining:
+                block = src.read(min(remaining, COPY_BLOCK))
+                if not block:
+                    break
+                dst.write(block)
+                remaining -= len(block)
+            dst.write(injection)
+            shutil.copyfileobj(src, dst, COPY_BLOCK)
+        shutil.copymode(page, tmp_name)
+        os.replace(tmp_name, page)
+    except BaseException:
+        os.unlink(tmp_name)
+        raise
     return True
 
 
+def file_hash(path: Path) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(COPY_BLOCK), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def load_manifest() -> dict[str, list]:
+    try:
+        return json.loads(MANIFEST.read_text(encoding="utf-8"))
+    except (OSError, ValueError):
+        return {}
+
+
+def save_manifest(manifest: dict[str, list]) -> None:
+    MANIFEST.parent.mkdir(parents=True, exist_ok=True)
+    tmp = MANIFEST.with_name(MANIFEST.name + ".tmp")
+    tmp.write_text(json.dumps(manifest, indent=1, sort_keys=True), encoding="utf-8")
+    os.replace(tmp, MANIFEST)
+
+
+def process_page(page: Path, previous: list | None) -> tuple[bool, list]:
+    """Inject the snippets unless the page is unchanged since the last run.
+
+    Returns whether the page was modified, and its new manifest entry
+    ``[mtime_ns, sha256]``.
+    """
+    mtime = page.stat().st_mtime_ns
+    if previous is not None and previous[0] == mtime:
+        return False, previous
+    digest = file_hash(page)
+    if previous is not None and previous[1] == digest:
+        return False, [mtime, digest]
+    injected = inject_scripts(page)
+    if injected:
+        mtime, digest = page.stat().st_mtime_ns, file_hash(page)
+    return injected, [mtime, digest]
+
+
+@contextmanager
+def phase(name: str, timings: dict[str, float]) -> Iterator[None]:
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        timings[name] = timings.get(name, 0.0) + time.perf_counter() - start
+
+
 def process_html() -> None:
     if not BUILD_TARGETS:
         raise FileNotFoundError(
             "No build outputs found in _build/site/public or _build/html"
         )
 
-    redirect_specs = build_redirect_specs()
-
-    for target in BUILD_TARGETS:
-        static_dest = target / "_static"
-        copy_static(static_dest)
-
-        injected = 0
-        for index_html in target.rglob("index.html"):
-            if inject_scripts(index_html):
-                injected += 1
-
-        print(f"Processed {target} -> injected scripts into {injected} HTML files.")
-
-        created = write_redirects(target, redirect_specs)
-        print(f"Generated {created} legacy redirect files under {target}")
+    timings: dict[str, float] = {}
+    with phase("redirect specs", timings):
+        redirect_specs = build_redirect_specs()
+    previous = load_manifest()
+    manifest: dict[str, list] = {}
+
+    with ThreadPoolExecutor(max_workers=MAX_WORKERS) as executor:
+        for target in BUILD_TARGETS:
+            with phase("static", timings):
+                copied = copy_static(target / "_static", executor)
+            print(f"Copied {copied} changed static files to {target / '_static'}")
+
+            with phase("pages", timings):
+                pages = sorted(target.rglob("index.html"))
+                keys = [page.relative_to(ROOT).as_posix() for page in pages]
+                results = list(
+                    executor.map(
+                        lambda page, key: process_page(page, previous.get(key)),
+                        pages,
+                        keys,
+                    )
+                )
+            manifest.update((key, entry) for key, (_, entry) in zip(keys, results))
+            injected = sum(changed for changed, _ in results)
+            print(f"Processed {target} -> injected scripts into {injected} HTML files.")
+
+            with phase("redirects", timings):
+                created = write_redirects(target, redirect_specs, executor)
+            print(f"Generated {created} legacy redirect files under {target}")
+
+    save_manifest(manifest)
+    print(
+        "Timings: "
+        + ", ".join(f"{name} {seconds:.3f} s" for name, seconds in timings.items())
+    )
 
 
 if __name__ == "__main__":